@@ -0,0 +1,158 @@
+import os
+import json
+from collections import defaultdict
+
+import numpy as np
+
+from mvn.utils.img import load_crop_resize_image
+
+
+META_FILENAME = 'meta.json'
+ROW2OFFSET_FILENAME = 'row2offset.npy'
+
+
+def _get_group_path(cache_dir, subject_name, action_name):
+    return os.path.join(cache_dir, subject_name, action_name + '.npy')
+
+
+def _load_meta(cache_dir):
+    meta_path = os.path.join(cache_dir, META_FILENAME)
+    if not os.path.isfile(meta_path):
+        return None
+
+    with open(meta_path, 'r') as f:
+        return json.load(f)
+
+
+def build_crops_cache(dataset, cache_dir, verbose=True):
+    """ pre-crops and pre-resizes (uint8) all views of all frames in `dataset`, into one memory-mappable array per (subject, action) ~ (n_frames, n_cameras, h, w, 3)
+
+    Args:
+        dataset: `Human36MMultiViewDataset` (its `scale_bbox`, `image_shape` and split are used)
+        cache_dir: output directory, also holds 'row2offset.npy' (full labels table row -> frame in its group, -1 if not cached) and 'meta.json' (crop params + what each cached split was built with)
+    """
+
+    table = dataset.labels['table']
+    rows = np.arange(len(table)) if table.indices is None else table.indices  # wrt full table
+    n_cameras = len(dataset.labels['camera_names'])
+    h, w = dataset.image_shape
+
+    groups = defaultdict(list)  # (subject_idx, action_idx) -> dataset indices
+    subject_idx, action_idx = table['subject_idx'], table['action_idx']
+    for idx in range(len(table)):
+        groups[(subject_idx[idx], action_idx[idx])].append(idx)
+
+    meta = {
+        'image_shape': list(dataset.image_shape),
+        'scale_bbox': dataset.scale_bbox,
+        'undistort_images': dataset.undistort_images,
+        'splits': {},
+    }
+    row2offset_path = os.path.join(cache_dir, ROW2OFFSET_FILENAME)
+    old_meta = _load_meta(cache_dir)
+    if old_meta is not None and os.path.isfile(row2offset_path) and \
+            all(old_meta[field] == meta[field] for field in ('image_shape', 'scale_bbox', 'undistort_images')):  # e.g other split already cached here
+        row2offset = np.load(row2offset_path)
+        meta['splits'] = old_meta.get('splits', {})
+    else:
+        row2offset = np.full(len(table.columns['subject_idx']), -1, dtype=np.int64)
+
+    split_name = dataset.get_split_name()
+    group_names = [
+        [dataset.labels['subject_names'][subject_i], dataset.labels['action_names'][action_i]]
+        for subject_i, action_i in sorted(groups.keys())
+    ]
+    for other_split in list(meta['splits'].keys()):  # splits with a group about to be overwritten are no longer cached
+        if other_split == split_name or \
+                any(group in meta['splits'][other_split]['groups'] for group in group_names):
+            del meta['splits'][other_split]
+
+    all_subject_idx, all_action_idx = table.columns['subject_idx'], table.columns['action_idx']
+    for (subject_i, action_i), indices in sorted(groups.items()):
+        subject_name = dataset.labels['subject_names'][subject_i]
+        action_name = dataset.labels['action_names'][action_i]
+
+        row2offset[(all_subject_idx == subject_i) & (all_action_idx == action_i)] = -1  # forget stale offsets of this group
+
+        group_path = _get_group_path(cache_dir, subject_name, action_name)
+        os.makedirs(os.path.dirname(group_path), exist_ok=True)
+        crops = np.lib.format.open_memmap(
+            group_path, mode='w+', dtype=np.uint8, shape=(len(indices), n_cameras, h, w, 3)
+        )
+
+        for offset, idx in enumerate(indices):
+            shot = table[idx]
+            for camera_idx, camera_name in enumerate(dataset.labels['camera_names']):
+                try:
+                    bbox = dataset.get_bbox(shot, camera_idx)
+                except ValueError:  # missing view => zeros
+                    crops[offset, camera_idx] = 0
+                    continue
+
+                image_path = dataset._get_view_path_from_shot(shot, camera_name)
+                image = load_crop_resize_image(image_path, bbox, dataset.image_shape, normalize=False)
+                if image is None:
+                    raise IOError('cannot load {}'.format(image_path))
+
+                crops[offset, camera_idx] = image
+
+            row2offset[rows[idx]] = offset
+
+        crops.flush()
+        del crops
+
+        if verbose:
+            print('cached {} frames of {}/{}'.format(len(indices), subject_name, action_name))
+
+    meta['splits'][split_name] = dict(dataset.get_split_params(), groups=group_names)
+
+    np.save(row2offset_path, row2offset)
+    with open(os.path.join(cache_dir, META_FILENAME), 'w') as f:
+        json.dump(meta, f)
+
+
+class CropsCache:
+    """ reads crops written by `build_crops_cache`: per-(subject, action) arrays are memory-mapped lazily (i.e in each worker) """
+
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+
+        self.meta = _load_meta(cache_dir)
+        if self.meta is None:
+            raise IOError('no crops cache in {}'.format(cache_dir))
+
+        self.row2offset = np.load(os.path.join(cache_dir, ROW2OFFSET_FILENAME), mmap_mode='r')
+        self.groups = {}
+
+    def check(self, image_shape, scale_bbox, undistort_images, split_name, split_params):
+        assert tuple(self.meta['image_shape']) == tuple(image_shape), 'crops cache was built with image_shape={}'.format(self.meta['image_shape'])
+        assert self.meta['scale_bbox'] == scale_bbox, 'crops cache was built with scale_bbox={}'.format(self.meta['scale_bbox'])
+        assert self.meta['undistort_images'] == undistort_images, 'crops cache was built with undistort_images={}'.format(self.meta['undistort_images'])
+
+        splits = self.meta.get('splits', {})
+        assert split_name in splits, 'crops cache has no {} split (only {})'.format(split_name, list(splits.keys()))
+        for param, value in split_params.items():
+            assert splits[split_name][param] == value, 'crops cache {} split was built with {}={}'.format(split_name, param, splits[split_name][param])
+
+    def _get_group(self, subject_name, action_name):
+        key = (subject_name, action_name)
+        if key not in self.groups:
+            self.groups[key] = np.load(
+                _get_group_path(self.cache_dir, subject_name, action_name), mmap_mode='r'
+            )
+
+        return self.groups[key]
+
+    def get(self, row, subject_name, action_name, camera_idx):
+        """ uint8 crop ~ (h, w, 3) of full labels table `row` seen by `camera_idx` """
+
+        offset = self.row2offset[row]
+        if offset < 0:
+            raise KeyError('row {} is not in crops cache {}'.format(row, self.cache_dir))
+
+        return self._get_group(subject_name, action_name)[offset, camera_idx]
+
+    def __getstate__(self):  # don't pickle memory-maps into workers
+        state = self.__dict__.copy()
+        state['groups'] = {}
+        return state
@@ -8,7 +8,9 @@ import cv2
 from torch.utils.data import Dataset
 
 from mvn.utils.multiview import Camera, build_intrinsics
-from mvn.utils.img import scale_bbox, rotation_matrix_from_vectors_rodrigues
+from mvn.datasets.labels import ColumnarTable, load_labels, load_split_indices, load_cached
+from mvn.datasets.crops import CropsCache
+from mvn.utils.img import scale_bbox, rotation_matrices_from_vectors_rodrigues, normalize_image_f32, get_effective_bbox
 
 
 # todo refactor diocan
@@ -35,7 +37,10 @@ class Human36MMultiViewDataset(Dataset):
                  resample_same_K=False,
                  look_at_pelvis=False,
                  pelvis_in_origin=False,
-                 scale2meters=False
+                 scale2meters=False,
+                 cache_look_at_pelvis=False,
+                 with_images=True,
+                 crops_cache_dir=None
                  ):
         """
             h36m_root:
@@ -43,6 +48,7 @@ class Human36MMultiViewDataset(Dataset):
             labels_path:
                 Path to 'human36m-multiview-labels.npy' generated by 'generate-labels-npy-multiview.py'
                 from https://github.sec.samsung.net/RRU8-VIOLET/human36m-preprocessing
+                (or to its columnar copy generated by 'convert-labels-npy-columnar.py')
             retain_every_n_frames_in_test:
                 By default, there are 159 181 frames in training set and 26 634 in test (val) set.
                 With this parameter, test set frames will be evenly skipped frames so that the
@@ -54,6 +60,13 @@ class Human36MMultiViewDataset(Dataset):
                 Keypoint format, 'mpii' or 'human36m'
             ignore_cameras:
                 A list with indices of cameras to exclude (0 to 3 inclusive)
+            cache_look_at_pelvis:
+                If `True`, the precomputed look-at-pelvis extrinsics are persisted next to the labels
+            with_images:
+                If `False`, samples have no 'images' at all (just cameras, keypoints and indices)
+            crops_cache_dir:
+                If given, images are read from the pre-cropped, pre-resized cache built by 'build-crops-cache.py'
+                (cameras are then the ones the images were shot with, updated after crop and resize)
         """
         assert train or test, '`Human36MMultiViewDataset` must be constructed with at least one of `test=True` / `train=True`'
         assert kind in ("mpii", "human36m")
@@ -73,8 +86,24 @@ class Human36MMultiViewDataset(Dataset):
         self.look_at_pelvis = look_at_pelvis
         self.pelvis_in_origin = pelvis_in_origin
         self.scale2m = scale2meters
+        self.with_images = with_images
 
-        self.labels = np.load(labels_path, allow_pickle=True).item()
+        self.train = train
+        self.retain_every_n_frames = retain_every_n_frames_in_train if train else retain_every_n_frames_in_test
+        self.with_damaged_actions = with_damaged_actions
+
+        self.crops_cache = None
+        if crops_cache_dir is not None:
+            if look_at_pelvis or scale2meters:  # crops only match the cameras they were shot with
+                raise ValueError('`crops_cache_dir` cannot be used with `look_at_pelvis` nor `scale2meters`')
+
+            self.crops_cache = CropsCache(crops_cache_dir)
+            self.crops_cache.check(
+                self.image_shape, self.scale_bbox, self.undistort_images,
+                self.get_split_name(), self.get_split_params()
+            )
+
+        self.labels = load_labels(labels_path)  # memory-mapped if a columnar copy exists
 
         n_cameras = len(self.labels['camera_names'])
         assert all(
@@ -82,6 +111,62 @@ class Human36MMultiViewDataset(Dataset):
             for camera_idx in self.ignore_cameras
         )
 
+        split_params = dict(self.get_split_params(), train=train)
+        indices = load_split_indices(
+            labels_path,
+            split_params,
+            lambda: self._compute_split_indices(**split_params)
+        )  # cached on disk
+
+        self.labels['table'] = ColumnarTable(self.labels['table'].columns, indices)  # index view, no copy
+        self.indices = [indices]
+
+        self.num_keypoints = 16 if kind == "mpii" else 17
+        assert self.labels['table'].columns['keypoints'].shape[1] == 17, "Use a newer 'labels' file"
+
+        self.keypoints_3d_pred = None
+        if pred_results_path is not None:
+            pred_results = np.load(pred_results_path, allow_pickle=True)
+            keypoints_3d_pred = pred_results['keypoints_3d'][np.argsort(pred_results['indexes'])]
+            self.keypoints_3d_pred = keypoints_3d_pred[::retain_every_n_frames_in_test]
+
+            assert len(self.keypoints_3d_pred) == len(self), \
+                f"[train={train}, test={test}] {labels_path} has {len(self)} samples, but '{pred_results_path}' " + \
+                f"has {len(self.keypoints_3d_pred)}. Did you follow all preprocessing instructions carefully?"
+
+        self.meshgrids = None
+
+        self._preprocess()
+        self.cameras_table = self._build_cameras_table(as_shot=self.crops_cache is not None)
+
+        self.look_at_pelvis_extrinsics = None
+        if self.look_at_pelvis:
+            if cache_look_at_pelvis:
+                self.look_at_pelvis_extrinsics = load_cached(
+                    labels_path,
+                    'look-at-pelvis',
+                    dict(split_params, pelvis_in_origin=self.pelvis_in_origin, scale2m=self.scale2m),
+                    self._build_look_at_pelvis_extrinsics,
+                    fields=('subject_idx', 'action_idx', 'keypoints')
+                )
+            else:
+                self.look_at_pelvis_extrinsics = self._build_look_at_pelvis_extrinsics()
+
+    def __len__(self):
+        return len(self.labels['table'])
+
+    def get_split_name(self):
+        return 'train' if self.train else 'test'
+
+    def get_split_params(self):
+        return {
+            'retain_every_n_frames': self.retain_every_n_frames,
+            'with_damaged_actions': self.with_damaged_actions,
+        }
+
+    def _compute_split_indices(self, train, retain_every_n_frames, with_damaged_actions):
+        table = self.labels['table']
+
         train_subjects = [
             self.labels['subject_names'].index(x)
             for x in ['S1', 'S6', 'S7', 'S8']  # todo solve missings in 'S5'
@@ -91,60 +176,114 @@ class Human36MMultiViewDataset(Dataset):
             for x in ['S9', 'S11']
         ]
 
-        indices = []
-
         if train:
-            mask = np.isin(
-                self.labels['table']['subject_idx'], train_subjects, assume_unique=True
-            )
-            indices.append(
-                np.nonzero(mask)[0][::retain_every_n_frames_in_train]
-            )
+            mask = np.isin(table['subject_idx'], train_subjects, assume_unique=True)
         else:  # test
-            mask = np.isin(self.labels['table']['subject_idx'], test_subjects, assume_unique=True)
+            mask = np.isin(table['subject_idx'], test_subjects, assume_unique=True)
 
             if not with_damaged_actions:
-                mask_S9 = self.labels['table']['subject_idx'] == self.labels['subject_names'].index('S9')
+                mask_S9 = table['subject_idx'] == self.labels['subject_names'].index('S9')
 
                 damaged_actions = [
                     self.labels['action_names'].index(x)
                     for x in ['Greeting-2', 'SittingDown-2', 'Waiting-1']
                 ]
-                mask_damaged_actions = np.isin(self.labels['table']['action_idx'], damaged_actions)
+                mask_damaged_actions = np.isin(table['action_idx'], damaged_actions)
 
                 mask &= ~(mask_S9 & mask_damaged_actions)
 
-            indices.append(np.nonzero(mask)[0][::retain_every_n_frames_in_test])
+        return np.nonzero(mask)[0][::retain_every_n_frames]
 
-        self.labels['table'] = self.labels['table'][np.concatenate(indices)]
-        self.indices = indices
+    def _preprocess(self):
+        if self.pelvis_in_origin:
+            self.labels['table']['keypoints'] = self._reparameterize_pelvis_in_origin(
+                self.labels['table']['keypoints'], 6
+            )
 
-        self.num_keypoints = 16 if kind == "mpii" else 17
-        assert self.labels['table']['keypoints'].shape[1] == 17, "Use a newer 'labels' file"
+    def get_head_alignment(self):
+        """ cosine similarity between the head (keypoint 9) and the Z axis, foreach frame """
 
-        self.keypoints_3d_pred = None
-        if pred_results_path is not None:
-            pred_results = np.load(pred_results_path, allow_pickle=True)
-            keypoints_3d_pred = pred_results['keypoints_3d'][np.argsort(pred_results['indexes'])]
-            self.keypoints_3d_pred = keypoints_3d_pred[::retain_every_n_frames_in_test]
+        head = self.labels['table']['keypoints'][:, 9]
+        return head[:, 2] / np.maximum(np.linalg.norm(head, axis=-1), 1e-8)
 
-            assert len(self.keypoints_3d_pred) == len(self), \
-                f"[train={train}, test={test}] {labels_path} has {len(self)} samples, but '{pred_results_path}' " + \
-                f"has {len(self.keypoints_3d_pred)}. Did you follow all preprocessing instructions carefully?"
+    def get_head_normal_indices(self, threshold=0.99, min_frames=2):
+        """ frames with head ~ Z. The threshold is lowered until there are at least `min_frames` of them """
 
-        self.meshgrids = None
+        scores = self.get_head_alignment()
+        min_frames = min(min_frames, len(scores))
 
-        self._preprocess()
+        mask = scores > threshold
+        while np.count_nonzero(mask) < min_frames:
+            threshold = threshold * 0.95 if threshold > 1e-3 else threshold - 0.05
+            mask = scores > threshold
 
-    def __len__(self):
-        return len(self.labels['table'])
+        return np.nonzero(mask)[0]
 
-    def _preprocess(self):
-        if self.pelvis_in_origin:
-            self.labels['table']['keypoints'] = np.float64([
-                self._reparameterize_pelvis_in_origin(kps, 6)
-                for kps in self.labels['table']['keypoints']
-            ])
+    def _build_cameras_table(self, as_shot=False):
+        """ final (same K, scaled) cameras foreach (subject, camera): there are only 7 x 4 of them. If `as_shot`, the cameras the images were shot with (i.e the ones the crops are taken from) """
+
+        n_subjects = len(self.labels['subject_names'])
+        n_cameras = len(self.labels['camera_names'])
+        cameras_table = np.empty((n_subjects, n_cameras), dtype=object)
+
+        for subject_idx in range(n_subjects):
+            for camera_idx, camera_name in enumerate(self.labels['camera_names']):
+                shot_camera = self.labels['cameras'][subject_idx, camera_idx]
+                camera = Camera(
+                    shot_camera['R'],
+                    shot_camera['t'],
+                    shot_camera['K'],
+                    shot_camera['dist'],
+                    camera_name
+                )
+
+                if not as_shot:
+                    self.have_same_K(camera)
+
+                    if self.scale2m:
+                        camera.scale_extrinsics(self.SCALE2M)
+                        camera.scale_K(np.sqrt(self.SCALE2M))  # see https://ksimek.github.io/perspective_camera_toy.html
+
+                cameras_table[subject_idx, camera_idx] = camera
+
+        return cameras_table
+
+    def _build_look_at_pelvis_extrinsics(self):
+        """ [R|t] foreach (frame, camera) rotated s.t the pelvis lies on the z axis, for the whole split at once
+
+        Returns:
+            numpy array of shape (n_frames, n_cameras, 3, 4): extrinsics
+        """
+
+        pelvis_index = 6  # H36M dataset, not CMU
+        scaling = self.SCALE2M if self.scale2m else 1.0  # pelvis is in mm
+
+        Rs = np.float64([
+            [camera.R for camera in cameras]
+            for cameras in self.cameras_table
+        ])  # ~ n_subjects, n_cameras, 3, 3
+        ts = np.float64([
+            [camera.t.reshape(3, 1) for camera in cameras]
+            for cameras in self.cameras_table
+        ])  # ~ n_subjects, n_cameras, 3, 1
+
+        subject_idx = self.labels['table']['subject_idx'].astype(np.int64)
+        R, t = Rs[subject_idx], ts[subject_idx]  # ~ n_frames, n_cameras, ...
+        n_frames, n_cameras = R.shape[:2]
+
+        pelvis = self.labels['table']['keypoints'][:, pelvis_index]  # in world, ~ n_frames, 3
+        pelvis_vectors = (R @ pelvis[:, np.newaxis, :, np.newaxis])[..., 0] + t[..., 0] * scaling
+
+        # find rotation matrix to align pelvis to z ...
+        z_axis = [0, 0, 1]
+        Rts = rotation_matrices_from_vectors_rodrigues(
+            pelvis_vectors.reshape(-1, 3), z_axis
+        ).reshape(n_frames, n_cameras, 3, 3)
+
+        # ... "At that point, after you re-sample, camera translation should be [0, 0, d_pelvis]"
+        return np.concatenate([
+            Rts @ R, Rts @ t  # rotation and scaling of t commute
+        ], axis=-1)
 
     def _get_frame_info(self, idx):
         shot = self.labels['table'][idx]
@@ -214,17 +353,58 @@ class Human36MMultiViewDataset(Dataset):
 
         raise IOError('fix that cluster !!!')
 
+    def load_view_cached(self, idx, shot, camera_idx, retval_camera):
+        """ pre-cropped, pre-resized (see `load_crop_resize_image`) view read from `self.crops_cache` (+ normalized). Returns the image and a new camera updated accordingly. A missing view is the zero crop stored by `build_crops_cache`, with the camera left as is """
+
+        try:
+            bbox = self.get_bbox(shot, camera_idx)
+        except ValueError:  # missing view
+            bbox = None
+
+        image = self.crops_cache.get(
+            self.labels['table'].indices[idx],  # row in full table
+            self.labels['subject_names'][shot['subject_idx']],
+            self.labels['action_names'][shot['action_idx']],
+            camera_idx
+        )
+
+        if self.norm_image:
+            image = normalize_image_f32(image)
+        else:
+            image = np.array(image)  # out of memory-map
+
+        if bbox is None:
+            return image, retval_camera
+
+        return image, self._update_camera_after_crop_resize(retval_camera, bbox)
+
+    def _update_camera_after_crop_resize(self, retval_camera, bbox):
+        bbox = get_effective_bbox(bbox, self.image_shape)  # crop may be enlarged by the reduced-scale decode
+        retval_camera = Camera(
+            retval_camera.R,
+            retval_camera.t,
+            retval_camera.K.copy(),  # cameras in table are shared
+            retval_camera.dist,
+            retval_camera.name
+        )
+        retval_camera.update_after_crop(bbox)
+        retval_camera.update_after_resize(
+            (bbox[3] - bbox[1], bbox[2] - bbox[0]), self.image_shape
+        )
+
+        return retval_camera
+
     @staticmethod
     def _reparameterize_pelvis_in_origin(kps, pelvis_i):
-        pelvis_in_world = kps[pelvis_i].reshape(3, 1)
+        """ all keypoints ~ (n_frames, n_joints, 3) at once, in-place if possible (a memory-mapped column is copied first) """
+
+        if not kps.flags.writeable or kps.dtype != np.float64:
+            kps = np.array(kps, dtype=np.float64)
 
-        origin = np.zeros_like(pelvis_in_world)
-        t_from_pelvis2origin = origin - pelvis_in_world
+        kps -= kps[:, pelvis_i: pelvis_i + 1]  # pelvis in origin
+        return kps
 
-        return np.float64([
-            kp.reshape(3, 1) + t_from_pelvis2origin.reshape(3, 1)
-            for kp in kps
-        ]).squeeze(-1)
+    SCALE2M = 1e3  # mm -> m
 
     @staticmethod
     def target_K():
@@ -246,7 +426,7 @@ class Human36MMultiViewDataset(Dataset):
         # scale the bounding box
         return scale_bbox(bbox, self.scale_bbox)
 
-    def preprocess_extrinsics(self, image, shot, camera_idx, retval_camera):
+    def preprocess_extrinsics(self, image, idx, shot, camera_idx, retval_camera):
         if False:  # using GTs ... self.crop:
             image = crop_image(image, bbox)
             bbox = self.get_bbox(shot, camera_idx)
@@ -264,26 +444,17 @@ class Human36MMultiViewDataset(Dataset):
             )
             retval_camera.K = self.target_K()
 
-        if self.look_at_pelvis:
-            pelvis_index = 6  # H36M dataset, not CMU
-
-            pelvis_vector = retval_camera.world2cam()(
-                shot['keypoints'][:self.num_keypoints]  # in world
-            )[pelvis_index]
-
-            # find rotation matrix to align pelvis to z ...
-            z_axis = [0, 0, 1]
-            Rt = rotation_matrix_from_vectors_rodrigues(
-                pelvis_vector, z_axis
+        if self.look_at_pelvis:  # precomputed in `_build_look_at_pelvis_extrinsics`
+            extrinsics = self.look_at_pelvis_extrinsics[idx, camera_idx]
+            retval_camera = Camera(
+                extrinsics[:, :3],
+                extrinsics[:, 3:],
+                retval_camera.K,
+                retval_camera.dist,
+                retval_camera.name
             )
 
-            # ... "At that point, after you re-sample, camera translation should be [0, 0, d_pelvis]"
-            retval_camera.update_extrinsics(Rt)
-
-        if self.scale2m:
-            scaling = 1e3  # mm -> m
-            retval_camera.scale_extrinsics(scaling)
-            retval_camera.scale_K(np.sqrt(scaling))  # see https://ksimek.github.io/perspective_camera_toy.html
+        return retval_camera
 
 
     def finalize_image(self, image):
@@ -299,21 +470,19 @@ class Human36MMultiViewDataset(Dataset):
 
         return image
 
-    def preprocess_sample(self, shot, camera_idx, camera_name):
-        image = np.zeros((16, 16, 3))  # using GT ... image = self._load_image(subject, action, camera_name, frame_idx)
+    def preprocess_sample(self, idx, shot, camera_idx, camera_name):
+        retval_camera = self.cameras_table[shot['subject_idx'], camera_idx]  # shared => do NOT modify in-place
 
-        shot_camera = self.labels['cameras'][shot['subject_idx'], camera_idx]
-        retval_camera = Camera(
-            shot_camera['R'],
-            shot_camera['t'],
-            shot_camera['K'],
-            shot_camera['dist'],
-            camera_name
-        )
+        image = None
+        if self.with_images and self.crops_cache is not None:  # already cropped and resized
+            image, retval_camera = self.load_view_cached(idx, shot, camera_idx, retval_camera)
+        elif self.with_images:
+            image = np.zeros((16, 16, 3))  # using GT ... image = self._load_image(subject, action, camera_name, frame_idx)
 
-        self.have_same_K(retval_camera)
-        self.preprocess_extrinsics(image, shot, camera_idx, retval_camera)
-        self.finalize_image(image)
+        retval_camera = self.preprocess_extrinsics(image, idx, shot, camera_idx, retval_camera)
+
+        if self.with_images and self.crops_cache is None:
+            self.finalize_image(image)
 
         return image, retval_camera
 
@@ -326,11 +495,14 @@ class Human36MMultiViewDataset(Dataset):
                 continue
 
             image, retval_camera = self.preprocess_sample(
+                idx,
                 shot,
                 camera_idx,
                 camera_name
             )
-            sample['images'].append(image)
+            if self.with_images:
+                sample['images'].append(image)
+
             # sample['detections'].append(bbox + (1.0,))  # TODO add real confidences
             sample['cameras'].append(retval_camera)
             sample['proj_matrices'].append(retval_camera.projection)
@@ -374,10 +546,11 @@ class Human36MMultiViewDataset(Dataset):
         meshgrids = np.empty((n_subjects, n_cameras), dtype=object)
 
         for sample_idx in range(len(self.labels['table'])):
-            subject_idx = self.labels['table']['subject_idx'][sample_idx]
+            shot = self.labels['table'][sample_idx]  # just this row
+            subject_idx = shot['subject_idx']
             
             if not meshgrids[subject_idx].any():
-                bboxes = self.labels['table']['bbox_by_camera_tlbr'][sample_idx]
+                bboxes = shot['bbox_by_camera_tlbr']
             
                 if (bboxes[:, 2] - bboxes[:, 0]).min() > 0:  # if == 0, then some camera is missing
                     sample = self.__getitem__(sample_idx)
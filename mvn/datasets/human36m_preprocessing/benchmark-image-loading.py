@@ -0,0 +1,70 @@
+"""
+    Compare (single worker) throughput of the legacy image path (`cv2.imread` -> `crop_image` -> `resize_image` -> `normalize_image`)
+    with the fused one (`load_crop_resize_image`: reduced-scale JPEG decode, uint8 crop, one resize, float32 normalization)
+
+    Usage: `python3 benchmark-image-loading.py <path/to/Human3.6M-root/processed> <path/to/human36m-multiview-labels-*bboxes.npy> [<n-frames>] [<image-size>]`
+"""
+import os, sys
+import time
+import numpy as np
+import cv2
+
+h36m_root = sys.argv[1]
+labels_path = sys.argv[2]
+
+try:    n_frames = int(sys.argv[3])
+except: n_frames = 100
+
+try:    image_size = int(sys.argv[4])
+except: image_size = 384
+
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), "../../.."))
+from mvn.datasets.human36m import Human36MMultiViewDataset
+from mvn.utils.img import crop_image, resize_image, normalize_image, load_crop_resize_image
+
+dataset = Human36MMultiViewDataset(
+    h36m_root,
+    labels_path,
+    train=True,
+    image_shape=(image_size, image_size),
+    retain_every_n_frames_in_train=max(1, 159181 // n_frames),
+    kind='human36m',
+    with_images=False
+)
+
+views = []
+for idx in range(min(n_frames, len(dataset))):
+    shot = dataset.labels['table'][idx]
+    for camera_idx, camera_name in enumerate(dataset.labels['camera_names']):
+        try:
+            bbox = dataset.get_bbox(shot, camera_idx)
+        except ValueError:  # missing view
+            continue
+
+        views.append((dataset._get_view_path_from_shot(shot, camera_name), bbox))
+
+
+def legacy(image_path, bbox):
+    image = cv2.imread(image_path)
+    image = crop_image(image, bbox)
+    image = resize_image(image, dataset.image_shape)
+    return normalize_image(image)
+
+
+def fused(image_path, bbox):
+    return load_crop_resize_image(image_path, bbox, dataset.image_shape)
+
+
+for image_path, _ in views:  # warm up page cache => both measure decode + processing, not the filesystem
+    with open(image_path, 'rb') as f:
+        f.read()
+
+for name, f in [('legacy', legacy), ('fused', fused)]:
+    start = time.time()
+    for image_path, bbox in views:
+        f(image_path, bbox)
+    elapsed = time.time() - start
+
+    print('{:>8}: {:.1f} views / s per worker ({} views in {:.1f} s)'.format(
+        name, len(views) / elapsed, len(views), elapsed
+    ))
@@ -0,0 +1,41 @@
+"""
+    Pre-crop and pre-resize (uint8) all views of a split, into one memory-mappable array per subject/action,
+    to be read by `Human36MMultiViewDataset(crops_cache_dir=...)` instead of per-frame JPEGs
+
+    Usage: `python3 build-crops-cache.py <path/to/Human3.6M-root/processed> <path/to/human36m-multiview-labels-*bboxes.npy> <path/to/output-dir> <train|test> [<retain-every-n-frames>] [<image-size>] [<scale-bbox>]`
+"""
+import os, sys
+
+h36m_root = sys.argv[1]
+labels_path = sys.argv[2]
+cache_dir = sys.argv[3]
+train = sys.argv[4] == 'train'
+
+try:    retain_every_n_frames = int(sys.argv[5])
+except: retain_every_n_frames = 1
+
+try:    image_size = int(sys.argv[6])
+except: image_size = 384
+
+try:    scale_bbox = float(sys.argv[7])
+except: scale_bbox = 1.0
+
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), "../../.."))
+from mvn.datasets.human36m import Human36MMultiViewDataset
+from mvn.datasets.crops import build_crops_cache
+
+dataset = Human36MMultiViewDataset(
+    h36m_root,
+    labels_path,
+    train=train,
+    test=not train,
+    image_shape=(image_size, image_size),
+    retain_every_n_frames_in_train=retain_every_n_frames,
+    retain_every_n_frames_in_test=retain_every_n_frames,
+    scale_bbox=scale_bbox,
+    kind='human36m',
+    with_images=False
+)
+print('caching {} frames into {}'.format(len(dataset), cache_dir))
+
+build_crops_cache(dataset, cache_dir)
@@ -0,0 +1,19 @@
+"""
+    Convert 'human36m-multiview-labels-*.npy' (pickled dict) into a columnar, non-pickled format,
+    i.e one .npy per table field + 'meta.json' (names and cameras), that can be memory-mapped by each DataLoader worker
+
+    Usage: `python3 convert-labels-npy-columnar.py <path/to/human36m-multiview-labels.npy> [<path/to/output-dir>]`
+"""
+import os, sys
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', '..', '..'))
+from mvn.datasets.labels import save_labels_columnar
+
+labels_path = sys.argv[1]
+out_dir = sys.argv[2] if len(sys.argv) > 2 else os.path.splitext(labels_path)[0] + '-columnar'
+
+labels = np.load(labels_path, allow_pickle=True).item()
+save_labels_columnar(labels, out_dir)
+
+print('saved {} frames to {}'.format(len(labels['table']), out_dir))
@@ -37,10 +37,11 @@ print("Computing distorted meshgrids")
 meshgrids = np.empty((n_subjects, n_cameras), dtype=object)
 
 for sample_idx in range(len(dataset))):
-    subject_idx = dataset.labels['table']['subject_idx'][sample_idx]
+    shot = dataset.labels['table'][sample_idx]  # just this row
+    subject_idx = shot['subject_idx']
     
     if not meshgrids[subject_idx].any():
-        bboxes = dataset.labels['table']['bbox_by_camera_tlbr'][sample_idx]
+        bboxes = shot['bbox_by_camera_tlbr']
     
         if (bboxes[:, 2] - bboxes[:, 0]).min() > 0: # if == 0, then some camera is missing
             sample = dataset[sample_idx]
@@ -0,0 +1,234 @@
+import os
+import json
+import hashlib
+import tempfile
+
+import numpy as np
+
+
+TABLE_FIELDS = ('subject_idx', 'action_idx', 'frame_idx', 'keypoints', 'bbox_by_camera_tlbr')
+NAMES_FIELDS = ('subject_names', 'camera_names', 'action_names')
+CAMERAS_FIELDS = ('R', 't', 'K', 'dist')
+META_FILENAME = 'meta.json'
+
+
+class ColumnarTable:
+    """ structured-array-like view over one array per field (possibly memory-mapped): `table['keypoints']` is a column, `table[i]` a row, `table[indices]` a sub-table. If `indices` is given, the table is an index view over the full columns (nothing is copied) """
+
+    def __init__(self, columns, indices=None):
+        self.columns = columns
+        self.indices = indices
+        self.view_columns = {}  # fields re-assigned on the index view => already in view coordinates
+        self.gathered = {}  # field -> full column gathered at `indices`, computed once
+
+    @classmethod
+    def from_structured(cls, table, indices=None):
+        return cls({
+            field: table[field]  # view, not a copy
+            for field in table.dtype.names
+        }, indices)
+
+    def __len__(self):
+        if self.indices is not None:
+            return len(self.indices)
+
+        return len(self.columns[TABLE_FIELDS[0]])
+
+    def _map(self, key):
+        return key if self.indices is None else self.indices[key]
+
+    def _index(self, field, key):
+        if field in self.view_columns:
+            return self.view_columns[field][key]
+
+        return self.columns[field][self._map(key)]
+
+    def __getitem__(self, key):
+        if isinstance(key, str):
+            if key in self.view_columns:
+                return self.view_columns[key]
+
+            if self.indices is None:
+                return self.columns[key]
+
+            if key not in self.gathered:
+                self.gathered[key] = self.columns[key][self.indices]
+
+            return self.gathered[key]
+
+        if np.isscalar(key):  # a row
+            return {
+                field: self._index(field, key)
+                for field in self.columns.keys()
+            }
+
+        return ColumnarTable({
+            field: self._index(field, key)
+            for field in self.columns.keys()
+        })
+
+    def __setitem__(self, field, column):
+        """ on an index view, only the view rows are stored (the full, maybe memory-mapped, column is untouched) """
+
+        assert len(column) == len(self)
+
+        if self.indices is None:
+            self.columns[field] = column
+        else:
+            self.view_columns[field] = column
+
+        self.gathered.pop(field, None)
+
+
+def _get_columnar_dir(labels_path):
+    return os.path.splitext(labels_path)[0] + '-columnar'
+
+
+def save_labels_columnar(labels, out_dir):
+    """ one non-pickled .npy foreach table column + a small JSON with names and cameras """
+
+    os.makedirs(out_dir, exist_ok=True)
+
+    for field in TABLE_FIELDS:
+        np.save(
+            os.path.join(out_dir, field + '.npy'),
+            np.ascontiguousarray(labels['table'][field])
+        )
+
+    meta = {
+        field: list(labels[field])
+        for field in NAMES_FIELDS
+    }
+    meta['cameras'] = {
+        field: labels['cameras'][field].tolist()
+        for field in CAMERAS_FIELDS
+    }
+
+    with open(os.path.join(out_dir, META_FILENAME), 'w') as f:
+        json.dump(meta, f)
+
+
+def _load_cameras(meta_cameras):
+    fields = {
+        field: np.float64(meta_cameras[field])
+        for field in CAMERAS_FIELDS
+    }
+
+    n_subjects, n_cameras = fields['R'].shape[:2]
+    cameras = np.empty(
+        (n_subjects, n_cameras),
+        dtype=[
+            ('R', np.float64, (3, 3)),
+            ('t', np.float64, (3, 1)),
+            ('K', np.float64, (3, 3)),
+            ('dist', np.float64, 5)
+        ]
+    )
+    for field, values in fields.items():
+        cameras[field] = values
+
+    return cameras
+
+
+def load_labels_columnar(labels_dir, mmap_mode='r'):
+    with open(os.path.join(labels_dir, META_FILENAME), 'r') as f:
+        meta = json.load(f)
+
+    labels = {
+        field: meta[field]
+        for field in NAMES_FIELDS
+    }
+    labels['cameras'] = _load_cameras(meta['cameras'])
+    labels['table'] = ColumnarTable({
+        field: np.load(
+            os.path.join(labels_dir, field + '.npy'),
+            mmap_mode=mmap_mode
+        )
+        for field in TABLE_FIELDS
+    })
+
+    return labels
+
+
+def resolve_labels_path(labels_path):
+    """ `labels_path` itself, or its '-columnar' sibling if it exists """
+
+    if not os.path.isdir(labels_path):
+        columnar_dir = _get_columnar_dir(labels_path)
+        if os.path.isdir(columnar_dir):
+            return columnar_dir
+
+    return labels_path
+
+
+def load_labels(labels_path, mmap_mode='r'):
+    """ loads labels from the columnar format (if `labels_path`, or its '-columnar' sibling, is such a directory), else from the pickled .npy """
+
+    labels_path = resolve_labels_path(labels_path)
+    if os.path.isdir(labels_path):
+        return load_labels_columnar(labels_path, mmap_mode=mmap_mode)
+
+    labels = np.load(labels_path, allow_pickle=True).item()
+    labels['table'] = ColumnarTable.from_structured(labels['table'])
+    return labels
+
+
+def get_labels_hash(labels_path, fields=('subject_idx', 'action_idx'), chunk_size=1 << 20):
+    """ hash of the labels content a cache depends on: the whole pickled .npy, or just `fields` (+ meta) in the columnar format """
+
+    labels_path = resolve_labels_path(labels_path)
+    if os.path.isdir(labels_path):
+        paths = [
+            os.path.join(labels_path, field + '.npy')
+            for field in fields
+        ] + [os.path.join(labels_path, META_FILENAME)]
+    else:
+        paths = [labels_path]
+
+    h = hashlib.sha1()
+    for path in paths:
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(chunk_size), b''):
+                h.update(chunk)
+
+    return h.hexdigest()
+
+
+def _get_cache_dir(labels_path, name):
+    return os.path.splitext(labels_path.rstrip(os.sep))[0] + '-' + name
+
+
+def load_cached(labels_path, name, params, compute_f, fields=('subject_idx', 'action_idx')):
+    """ array cached on disk next to the labels (in '<labels>-<name>/'), keyed by the hash of the labels `fields` and `params` (a JSON-able dict). Calls `compute_f()` on cache miss """
+
+    key = hashlib.sha1(json.dumps({
+        'labels': get_labels_hash(labels_path, fields),
+        name: params
+    }, sort_keys=True).encode()).hexdigest()
+
+    cache_path = os.path.join(_get_cache_dir(labels_path, name), key + '.npy')
+    if os.path.isfile(cache_path):
+        return np.load(cache_path)
+
+    array = compute_f()
+    try:
+        os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+        with tempfile.NamedTemporaryFile(dir=os.path.dirname(cache_path), suffix='.npy', delete=False) as f:
+            np.save(f, array)
+
+        os.replace(f.name, cache_path)  # atomic => concurrent readers never see a partial file
+    except OSError as e:
+        print('cannot cache {} in {}: {}'.format(name, cache_path, e))
+
+    return array
+
+
+def load_split_indices(labels_path, split_params, compute_f):
+    """ split indices cached on disk next to the labels, keyed by labels hash and `split_params` """
+
+    return load_cached(
+        labels_path,
+        'splits',
+        split_params,
+        lambda: np.asarray(compute_f(), dtype=np.int64)
+    )
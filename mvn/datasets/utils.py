@@ -1,11 +1,71 @@
 import numpy as np
 import torch
-from torch import nn
+from torch.utils.data import Sampler
 
-from mvn.utils.img import image_batch_to_torch
+from mvn.utils.multiview import CameraBatch
 
 
-def make_collate_fn(randomize_n_views=True, min_n_views=4, max_n_views=31):
+def collate_images(items, indexes, pin_memory=False):
+    """ writes (h, w, c) images straight into a preallocated (batch_size, n_views, c, h, w) float tensor, i.e in the final layout and dtype
+
+    Args:
+        pin_memory: allocate in page-locked memory (leave False within DataLoader workers: DataLoader(pin_memory=True) pins in the main process)
+    """
+
+    h, w, c = np.shape(items[0]['images'][indexes[0]])
+    images = torch.empty(
+        (len(items), len(indexes), c, h, w),
+        dtype=torch.float,
+        pin_memory=pin_memory
+    )
+
+    for batch_i, item in enumerate(items):
+        for view_i, i in enumerate(indexes):
+            images[batch_i, view_i].copy_(
+                torch.from_numpy(np.asarray(item['images'][i])).permute(2, 0, 1)
+            )  # transpose + cast in one pass
+
+    return images
+
+
+class EligibleFramesSampler(Sampler):
+    """ draws only from the (precomputed) eligible dataset `indices`, e.g frames with the head aligned to Z. If `distributed`, behaves like `DistributedSampler`: all replicas shuffle with the same (seed + epoch) permutation, padded to be evenly divisible, and each takes its own slice """
+
+    def __init__(self, indices, shuffle=True, distributed=False, seed=0):
+        self.indices = np.asarray(indices, dtype=np.int64)
+        self.shuffle = shuffle
+        self.seed = seed
+        self.epoch = 0
+
+        if distributed and torch.distributed.is_available() and torch.distributed.is_initialized():
+            self.rank, self.world_size = torch.distributed.get_rank(), torch.distributed.get_world_size()
+        else:
+            self.rank, self.world_size = 0, 1
+
+        self.num_samples = int(np.ceil(len(self.indices) / self.world_size))
+        self.total_size = self.num_samples * self.world_size
+
+    def set_epoch(self, epoch):
+        self.epoch = epoch
+
+    def __iter__(self):
+        if self.shuffle:
+            g = torch.Generator()
+            g.manual_seed(self.seed + self.epoch)
+            indices = self.indices[torch.randperm(len(self.indices), generator=g).numpy()]
+        else:
+            indices = self.indices
+
+        if self.total_size > len(indices):  # pad (wrapping around) => same length on all replicas
+            indices = np.resize(indices, self.total_size)
+
+        return iter(indices[self.rank:self.total_size:self.world_size].tolist())
+
+    def __len__(self):
+        return self.num_samples
+
+
+def make_collate_fn(randomize_n_views=True, min_n_views=4, max_n_views=31, pin_memory=False):
     def collate_fn(items):
         items = list(filter(lambda x: x is not None, items))
         if len(items) == 0:
@@ -13,7 +73,7 @@ def make_collate_fn(randomize_n_views=True, min_n_views=4, max_n_views=31):
             return None
 
         batch = dict()
-        total_n_views = min(len(item['images']) for item in items)
+        total_n_views = min(len(item['cameras']) for item in items)
 
         indexes = np.arange(total_n_views)
         if randomize_n_views:
@@ -22,23 +82,29 @@ def make_collate_fn(randomize_n_views=True, min_n_views=4, max_n_views=31):
         else:
             indexes = np.arange(total_n_views)
 
-        batch['images'] = np.stack([
-            np.stack([
-                item['images'][i]
-                for item in items
-            ], axis=0)
-            for i in indexes
-        ], axis=0).swapaxes(0, 1)
+        if 'images' in items[0]:  # else no-images mode
+            batch['images'] = collate_images(items, indexes, pin_memory)  # ~ (batch_size, n_views, c, h, w)
 
-        batch['cameras'] = [
+        batch['cameras'] = CameraBatch.from_cameras([
             [
                 item['cameras'][i]
-                for item in items
+                for i in indexes
             ]
-            for i in indexes
-        ]
+            for item in items
+        ])  # stacked arrays ~ (batch_size, n_views, ...), cheap to pickle
 
-        batch['keypoints_3d'] = [item['keypoints_3d'] for item in items]
+        batch['keypoints_3d'] = np.stack([
+            item['keypoints_3d']
+            for item in items
+        ], axis=0)  # ~ (batch_size, n_joints, 3 + 1 validity)
+
+        # ready-made contiguous tensors (=> pinned by `DataLoader(pin_memory=True)`), shared by all pipelines
+        _to_tensor = lambda x, dtype=None: torch.from_numpy(np.ascontiguousarray(x, dtype=dtype))
+        batch['keypoints_3d_gt'] = _to_tensor(batch['keypoints_3d'][..., :3], np.float32)
+        batch['keypoints_3d_validity'] = _to_tensor(batch['keypoints_3d'][..., 3:], np.float32)
+        batch['proj_matricies'] = _to_tensor(batch['cameras'].projection, np.float32)  # ~ (batch_size, n_views, 3, 4)
+        batch['extrinsics'] = _to_tensor(batch['cameras'].extrinsics_padded)  # ~ (batch_size, n_views, 4, 4), cameras dtype (cast where used)
+        batch['intrinsics'] = _to_tensor(batch['cameras'].K)  # ~ (batch_size, n_views, 3, 3), cameras dtype (cast where used)
         # batch['cuboids'] = [item['cuboids'] for item in items]
         batch['indexes'] = [
             item['indexes']
@@ -88,81 +154,32 @@ def cam2cam_precomputed_batch(src, target, cameras_batch, batch_i, cam2cams):
     )  # 3 x 4
 
 
+def get_cameras_batch(batch, device):
+    """ `CameraBatch` of torch tensors on `device`, straight from the contiguous extrinsics and intrinsics emitted by `collate_fn` (in the cameras dtype, i.e float64: cast where used) """
+
+    extrinsics = batch['extrinsics'].to(device, non_blocking=True)  # ~ (batch_size, n_views, 4, 4)
+    intrinsics = batch['intrinsics'].to(device, non_blocking=True)  # ~ (batch_size, n_views, 3, 3)
+
+    return CameraBatch(
+        extrinsics[..., :3, :3],
+        extrinsics[..., :3, 3:],
+        intrinsics,
+        names=batch['cameras'].names
+    )
+
+
 def prepare_batch(batch, device, config, is_train=True):
-    images_batch = []
-    for image_batch in batch['images']:
-        image_batch = image_batch_to_torch(image_batch)
-        image_batch = image_batch.to(device)
-        images_batch.append(image_batch)
-
-    images_batch = torch.stack(images_batch, dim=0)
-
-    # 3D keypoints
-    keypoints_3d_batch_gt = torch.from_numpy(
-        np.stack(batch['keypoints_3d'], axis=0)[:, :, :3]
-    ).float().to(device)
-
-    # 3D keypoints validity
-    keypoints_3d_validity_batch_gt = torch.from_numpy(np.stack(batch['keypoints_3d'], axis=0)[:, :, 3:]).float().to(device)
-
-    # projection matricies
-    proj_matricies_batch = torch.stack([
-        torch.stack([
-            torch.from_numpy(camera.projection)
-            for camera in camera_batch
-        ], dim=0)
-        for camera_batch in batch['cameras']
-    ], dim=0).transpose(1, 0)  # shape (batch_size=8, n_views=4, 3, 4)
-    proj_matricies_batch = proj_matricies_batch.float().to(device)
-
-    cameras = batch['cameras']
-    indices = batch['indexes']  # wrt to dataset
+    images_batch = None  # no-images mode
+    if 'images' in batch:
+        images_batch = batch['images'].to(device, non_blocking=True)  # already (batch_size, n_views, c, h, w)
 
-    if config.cam2cam.data.head_normal and is_train:
-        def _get_head_normal(threshold):
-            batch_size = keypoints_3d_batch_gt.shape[0]
-            Z_axis = torch.tensor([0., 0., 1.0])\
-                .to(keypoints_3d_batch_gt.device)
-            head_aligned_Z = nn.CosineSimilarity(dim=1, eps=1e-08)(
-                Z_axis.unsqueeze(0).repeat(batch_size, 1),
-                keypoints_3d_batch_gt[:, 9],
-            )
-            mask = (head_aligned_Z > threshold).cpu().numpy().astype(bool)
-            return np.arange(batch_size)[mask]
-
-        def _resample(mask, indices, cameras, images_batch,\
-            keypoints_3d_batch_gt, keypoints_3d_validity_batch_gt,\
-            proj_matricies_batch):
-            indices = np.uint8(indices)[mask]
-            cameras = [
-                [
-                    cameras[cam_i][batch_i]
-                    for batch_i in range(len(batch['indexes']))
-                    if batch_i in mask
-                ]
-                for cam_i in range(len(cameras))
-            ]
-            images_batch = images_batch[mask]
-            keypoints_3d_batch_gt = keypoints_3d_batch_gt[mask]
-            keypoints_3d_validity_batch_gt =\
-                keypoints_3d_validity_batch_gt[mask]
-            proj_matricies_batch = proj_matricies_batch[mask]
-
-            return indices, cameras, images_batch,\
-                keypoints_3d_batch_gt, keypoints_3d_validity_batch_gt,\
-                proj_matricies_batch
-
-        threshold = 0.99
-        mask = _get_head_normal(threshold)
-        while len(mask) < 2:  # avoid empty batches
-            threshold *= 0.95
-            mask = _get_head_normal(threshold)
-
-        return _resample(
-            mask, indices, cameras, images_batch,\
-            keypoints_3d_batch_gt, keypoints_3d_validity_batch_gt,\
-            proj_matricies_batch
-        )
+    # 3D keypoints, their validity and projection matricies (already stacked by `collate_fn`)
+    keypoints_3d_batch_gt = batch['keypoints_3d_gt'].to(device, non_blocking=True)
+    keypoints_3d_validity_batch_gt = batch['keypoints_3d_validity'].to(device, non_blocking=True)
+    proj_matricies_batch = batch['proj_matricies'].to(device, non_blocking=True)  # shape (batch_size=8, n_views=4, 3, 4)
+
+    cameras = get_cameras_batch(batch, device)  # torch, on `device`
+    indices = batch['indexes']  # wrt to dataset
 
     return indices, cameras, images_batch,\
         keypoints_3d_batch_gt, keypoints_3d_validity_batch_gt,\
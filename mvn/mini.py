@@ -53,6 +53,7 @@ def get_config(config_path, data_folder='/home/stefano/Scuola/tud/_classes/4/the
     config.model.backbone.num_layers = 18  # very small BB
     config.model.backbone.num_deconv_filters = 32
 
+    config.dataset.with_images = not (config.model.cam2cam_estimation and config.cam2cam.data.using_gt)  # GT KPs => no need for images
     config.dataset.train.crop = not config.model.cam2cam_estimation  # doing resampling when estimating cam2cam => no crop
     config.dataset.train.h36m_root = data_folder + 'processed/'
     config.dataset.train.labels_path = data_folder + 'human36m-multiview-labels-GTbboxes.npy'
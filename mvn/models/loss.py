@@ -79,7 +79,10 @@ class VolumetricCELoss(nn.Module):
             coord_volume = coord_volumes_batch[batch_i]
             keypoints_gt_i = keypoints_gt[batch_i]
 
-            coord_volume_unsq = coord_volume.unsqueeze(0)
+            if coord_volume.dim() == 5:  # one coord volume per joint (coarse-to-fine)
+                coord_volume_unsq = coord_volume
+            else:
+                coord_volume_unsq = coord_volume.unsqueeze(0)
             keypoints_gt_i_unsq = keypoints_gt_i.unsqueeze(1).unsqueeze(1).unsqueeze(1)
 
             dists = torch.sqrt(((coord_volume_unsq - keypoints_gt_i_unsq) ** 2).sum(-1))
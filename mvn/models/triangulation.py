@@ -1,4 +1,3 @@
-from copy import deepcopy
 import numpy as np
 import random
 
@@ -21,6 +20,8 @@ class RANSACTriangulationNet(nn.Module):
         self.backbone = pose_resnet.get_pose_net(config.model.backbone, device=device)
         
         self.direct_optimization = config.model.direct_optimization
+        self.batched = config.model.batched_ransac if hasattr(config.model, "batched_ransac") else True  # else per joint (slow)
+        self.subpixel_argmax = config.model.subpixel_argmax if hasattr(config.model, "subpixel_argmax") else False
 
     def forward(self, images, proj_matricies, batch):
         batch_size, n_views = images.shape[:2]
@@ -40,14 +41,21 @@ class RANSACTriangulationNet(nn.Module):
         batch_size, n_views, n_joints, heatmap_shape = heatmaps.shape[0], heatmaps.shape[1], heatmaps.shape[2], tuple(heatmaps.shape[3:])
 
         # keypoints 2d
-        _, max_indicies = torch.max(heatmaps.view(batch_size, n_views, n_joints, -1), dim=-1)
-        keypoints_2d = torch.stack([max_indicies % heatmap_shape[1], max_indicies // heatmap_shape[1]], dim=-1).to(images.device)
+        keypoints_2d = op.heatmap_argmax_2d(heatmaps, subpixel=self.subpixel_argmax)
 
         # upscale keypoints_2d, because image shape != heatmap shape
-        keypoints_2d_transformed = torch.zeros_like(keypoints_2d)
-        keypoints_2d_transformed[:, :, :, 0] = keypoints_2d[:, :, :, 0] * (image_shape[1] / heatmap_shape[1])
-        keypoints_2d_transformed[:, :, :, 1] = keypoints_2d[:, :, :, 1] * (image_shape[0] / heatmap_shape[0])
-        keypoints_2d = keypoints_2d_transformed
+        keypoints_2d = op.heatmap_to_image_coords(keypoints_2d, heatmap_shape, image_shape)
+
+        if self.batched:  # all view pairs as hypotheses, all joints at once
+            keypoints_3d, _ = multiview.triangulate_batch_of_points_ransac(
+                proj_matricies.detach().type(torch.float64),
+                keypoints_2d.detach().type(torch.float64),
+                direct_optimization=self.direct_optimization
+            )
+
+            keypoints_3d = keypoints_3d.type(torch.float)
+            confidences = torch.zeros(batch_size, n_views, n_joints, device=images.device)  # plug
+            return keypoints_3d, keypoints_2d, heatmaps, confidences
 
         # triangulate (cpu)
         keypoints_2d_np = keypoints_2d.detach().cpu().numpy()
@@ -150,6 +158,8 @@ class AlgebraicTriangulationNet(nn.Module):
 
         self.just_2d = config.model.cam2cam_estimation
         self.in_world_space = config.model.triangulate_in_world_space  # else it's in cam space
+        self.triangulation_method = config.model.triangulation_method if hasattr(config.model, "triangulation_method") else "svd"  # or 'eigh', 'jacobi'
+        self.return_heatmaps = config.model.return_heatmaps if hasattr(config.model, "return_heatmaps") else True  # else the raw ones are returned
 
     def forward(self, images, proj_matricies, minimon=None):
         device = images.device
@@ -172,7 +182,11 @@ class AlgebraicTriangulationNet(nn.Module):
             minimon.leave('alg: backbone')
 
         heatmaps_before_softmax = heatmaps.view(batch_size, n_views, *heatmaps.shape[1:])
-        keypoints_2d, heatmaps = op.integrate_tensor_2d(heatmaps * self.heatmap_multiplier, self.heatmap_softmax)
+        keypoints_2d, heatmaps_normalized = op.integrate_tensor_2d(
+            heatmaps * self.heatmap_multiplier, self.heatmap_softmax, return_heatmaps=self.return_heatmaps
+        )
+        if heatmaps_normalized is not None:
+            heatmaps = heatmaps_normalized
 
         # reshape back
         images = images.view(batch_size, n_views, *images.shape[1:])
@@ -189,15 +203,14 @@ class AlgebraicTriangulationNet(nn.Module):
         batch_size, n_views, n_joints, heatmap_shape = heatmaps.shape[0], heatmaps.shape[1], heatmaps.shape[2], tuple(heatmaps.shape[3:])
 
         # upscale keypoints_2d, because image shape != heatmap shape
-        keypoints_2d_transformed = torch.zeros_like(keypoints_2d)
-        keypoints_2d_transformed[:, :, :, 0] = keypoints_2d[:, :, :, 0] * (image_shape[1] / heatmap_shape[1])
-        keypoints_2d_transformed[:, :, :, 1] = keypoints_2d[:, :, :, 1] * (image_shape[0] / heatmap_shape[0])
-        keypoints_2d = keypoints_2d_transformed  # ~ (batch_size=8, n_views=4, n_joints=17, 2D)
+        keypoints_2d = op.heatmap_to_image_coords(keypoints_2d, heatmap_shape, image_shape)  # ~ (batch_size=8, n_views=4, n_joints=17, 2D)
 
         if self.just_2d:
             return keypoints_2d, heatmaps, alg_confidences
 
         # triangulate with possible methods:
+        # - batched (default): `triangulate_batch_of_points_linear`, 1 SVD for all (batch, joint) pairs, on same device
+        # - batched normal equations: `triangulate_batch_of_points_normal_equations`, 1 4 x 4 eigensolve for all (batch, joint) pairs
         # - cpu: `triangulate_batch_of_points` with .cpu()
         # - gpu (classic): `triangulate_batch_of_points` with .cuda()
         # - gpu (friendly): `triangulate_batch_of_points_using_gpu_friendly_svd` with .cuda()
@@ -206,12 +219,19 @@ class AlgebraicTriangulationNet(nn.Module):
             if minimon:
                 minimon.enter()
 
-            keypoints_3d = multiview.triangulate_batch_of_points(
-                proj_matricies.cpu(),
-                keypoints_2d.cpu(),
-                triangulator=multiview.triangulate_point_from_multiple_views_linear_torch,
-                confidences_batch=alg_confidences.cpu()
-            )
+            if self.triangulation_method == 'svd':
+                keypoints_3d = multiview.triangulate_batch_of_points_linear(
+                    proj_matricies,
+                    keypoints_2d,
+                    confidences_batch=alg_confidences
+                )  # ~ (batch_size=8, n_joints=17, 3)
+            else:
+                keypoints_3d = multiview.triangulate_batch_of_points_normal_equations(
+                    proj_matricies,
+                    keypoints_2d,
+                    confidences_batch=alg_confidences,
+                    method=self.triangulation_method
+                )
             
             if minimon:
                 minimon.leave('alg: tri in world')
@@ -220,9 +240,9 @@ class AlgebraicTriangulationNet(nn.Module):
                 minimon.enter()
 
             keypoints_3d = multiview.triangulate_batch_of_points_in_cam_space(
-                proj_matricies.cpu(),
-                keypoints_2d.cpu(),
-                confidences_batch=alg_confidences.cpu()
+                proj_matricies.to(device),
+                keypoints_2d,
+                confidences_batch=alg_confidences
             )
 
             if minimon:
@@ -232,6 +252,8 @@ class AlgebraicTriangulationNet(nn.Module):
 
 
 class VolumetricTriangulationNet(nn.Module):
+    V2V_TOTAL_STRIDE = 32  # 5 stride-2 poolings in the V2V encoder
+
     def __init__(self, config, device='cuda:0'):
         super().__init__()
 
@@ -245,6 +267,23 @@ class VolumetricTriangulationNet(nn.Module):
 
         self.cuboid_side = config.model.cuboid_side
 
+        # coarse-to-fine: lift to a low-res volume, then re-lift a high-res sub-cuboid around each joint
+        self.coarse_to_fine = config.model.coarse_to_fine if hasattr(config.model, "coarse_to_fine") else False
+        self.coarse_volume_size = config.model.coarse_volume_size if hasattr(config.model, "coarse_volume_size") else 32
+        self.fine_volume_size = config.model.fine_volume_size if hasattr(config.model, "fine_volume_size") else 32
+        self.fine_cuboid_side = config.model.fine_cuboid_side if hasattr(config.model, "fine_cuboid_side") else self.cuboid_side / 8
+
+        v2v_total_stride = config.model.v2v_total_stride if hasattr(config.model, "v2v_total_stride") else self.V2V_TOTAL_STRIDE
+        volume_sizes = {
+            'coarse_volume_size': self.coarse_volume_size,
+            'fine_volume_size': self.fine_volume_size,
+        } if self.coarse_to_fine else {
+            'volume_size': self.volume_size,
+        }
+        for name, size in volume_sizes.items():
+            if size % v2v_total_stride != 0:
+                raise ValueError('{}={} must be a multiple of the V2V total stride ({})'.format(name, size, v2v_total_stride))
+
         self.kind = config.model.kind
         self.use_gt_pelvis = config.model.use_gt_pelvis
 
@@ -272,6 +311,81 @@ class VolumetricTriangulationNet(nn.Module):
 
         self.volume_net = V2VModel(32, self.num_joints)
 
+    def _build_coord_volumes(self, base_points, cuboid_side, volume_size, thetas, axis):
+        coord_volumes = volumetric.build_coord_volumes(
+            base_points, cuboid_side, volume_size, thetas, axis
+        )  # ~ (batch_size, volume_size, volume_size, volume_size, 3)
+
+        if self.transfer_cmu_to_human36m:  # different world coordinates
+            coord_volumes = coord_volumes.permute(0, 1, 3, 2, 4).flip(2).contiguous()
+
+        return coord_volumes
+
+    def _lift(self, features, proj_matricies, coord_volumes, vol_confidences):
+        volumes = op.unproject_heatmaps(
+            features,
+            proj_matricies,
+            coord_volumes,
+            volume_aggregation_method=self.volume_aggregation_method,
+            vol_confidences=vol_confidences
+        )
+        return self.volume_net(volumes)
+
+    def _lift_coarse_to_fine(self, features, proj_matricies, base_points, thetas, axis, vol_confidences):
+        """ lifts a coarse volume around the pelvis, locates joints there and re-lifts a small fine sub-cuboid per joint
+
+        Returns:
+            vol_keypoints_3d torch tensor of shape (batch_size, n_joints, 3): keypoints in fine sub-cuboids
+            volumes torch tensor of shape (batch_size, n_joints, fine_size, fine_size, fine_size): fine volumes
+            coord_volumes torch tensor of shape (batch_size, n_joints, fine_size, fine_size, fine_size, 3): coords of fine volumes
+        """
+
+        batch_size = features.shape[0]
+        n_joints = self.num_joints
+        fine_size = self.fine_volume_size
+
+        # coarse
+        coarse_coord_volumes = self._build_coord_volumes(
+            base_points, self.cuboid_side, self.coarse_volume_size, thetas, axis
+        )
+        coarse_volumes = self._lift(features, proj_matricies, coarse_coord_volumes, vol_confidences)
+        coarse_keypoints_3d, _ = op.integrate_tensor_3d_with_coordinates(
+            coarse_volumes * self.volume_multiplier, coarse_coord_volumes, softmax=self.volume_softmax, return_volumes=False
+        )  # ~ (batch_size, n_joints, 3)
+
+        # fine: one sub-cuboid per joint, stacked along x to lift all of them at once
+        coord_volumes = self._build_coord_volumes(
+            coarse_keypoints_3d.detach().reshape(-1, 3),
+            self.fine_cuboid_side,
+            fine_size,
+            np.repeat(thetas, n_joints),
+            axis
+        )  # ~ (batch_size * n_joints, fine_size, fine_size, fine_size, 3)
+        coord_volumes = coord_volumes.view(batch_size, n_joints, fine_size, fine_size, fine_size, 3)
+
+        volumes = op.unproject_heatmaps(
+            features,
+            proj_matricies,
+            coord_volumes.view(batch_size, n_joints * fine_size, fine_size, fine_size, 3),
+            volume_aggregation_method=self.volume_aggregation_method,
+            vol_confidences=vol_confidences
+        )  # ~ (batch_size, n_features, n_joints * fine_size, fine_size, fine_size)
+        n_features = volumes.shape[1]
+        volumes = volumes.view(batch_size, n_features, n_joints, fine_size, fine_size, fine_size)
+        volumes = volumes.transpose(1, 2).reshape(-1, n_features, fine_size, fine_size, fine_size)
+
+        volumes = self.volume_net(volumes)  # ~ (batch_size * n_joints, n_joints, ...)
+
+        # each sub-cuboid is only responsible for its own joint
+        joints = torch.arange(n_joints, device=volumes.device)
+        volumes = volumes.view(batch_size, n_joints, n_joints, fine_size, fine_size, fine_size)[:, joints, joints]
+
+        vol_keypoints_3d, volumes = op.integrate_tensor_3d_with_coordinates(
+            volumes * self.volume_multiplier, coord_volumes, softmax=self.volume_softmax
+        )
+
+        return vol_keypoints_3d, volumes, coord_volumes
+
 
     def forward(self, images, proj_matricies, batch, minimon=None):
         device = images.device
@@ -308,100 +422,59 @@ class VolumetricTriangulationNet(nn.Module):
             vol_confidences = vol_confidences / vol_confidences.sum(dim=1, keepdim=True)
 
         # change camera intrinsics
-        new_cameras = deepcopy(batch['cameras'])
-        for view_i in range(n_views):
-            for batch_i in range(batch_size):
-                new_cameras[view_i][batch_i].update_after_resize(
-                    image_shape, heatmap_shape
-                )
-
-        proj_matricies = torch.stack([torch.stack([torch.from_numpy(camera.projection) for camera in camera_batch], dim=0) for camera_batch in new_cameras], dim=0).transpose(1, 0)  # shape (batch_size, n_views, 3, 4)
-        proj_matricies = proj_matricies.float().to(device)
+        proj_matricies = multiview.rescale_proj_matricies(
+            proj_matricies.float().to(device), image_shape, heatmap_shape
+        )  # ~ (batch_size, n_views, 3, 4)
 
         # build coord volumes
-        cuboids = []
-        base_points = torch.zeros(batch_size, 3, device=device)
-        coord_volumes = torch.zeros(batch_size, self.volume_size, self.volume_size, self.volume_size, 3, device=device)
-        for batch_i in range(batch_size):
-            if self.use_gt_pelvis:
-                keypoints_3d = batch['keypoints_3d'][batch_i]
-            else:
-                keypoints_3d = batch['pred_keypoints_3d'][batch_i]
-
-            if self.kind == "coco":
-                base_point = (keypoints_3d[11, :3] + keypoints_3d[12, :3]) / 2
-            elif self.kind == "mpii":
-                base_point = keypoints_3d[6, :3]
-
-            base_points[batch_i] = torch.from_numpy(base_point).to(device)
-
-            # build cuboid L x L x L
-            sides = np.array([
-                self.cuboid_side, self.cuboid_side, self.cuboid_side
-            ])
-            position = base_point - sides / 2
-            cuboid = volumetric.Cuboid3D(position, sides)
-
-            cuboids.append(cuboid)
-
-            # build coord volume
-            xxx, yyy, zzz = torch.meshgrid(torch.arange(self.volume_size, device=device), torch.arange(self.volume_size, device=device), torch.arange(self.volume_size, device=device))
-            grid = torch.stack([xxx, yyy, zzz], dim=-1).type(torch.float)
-            grid = grid.reshape((-1, 3))
-
-            grid_coord = torch.zeros_like(grid)
-            grid_coord[:, 0] = position[0] + (sides[0] / (self.volume_size - 1)) * grid[:, 0]
-            grid_coord[:, 1] = position[1] + (sides[1] / (self.volume_size - 1)) * grid[:, 1]
-            grid_coord[:, 2] = position[2] + (sides[2] / (self.volume_size - 1)) * grid[:, 2]
-
-            coord_volume = grid_coord.reshape(self.volume_size, self.volume_size, self.volume_size, 3)
-
-            # random rotation
-            if self.training:
-                theta = np.random.uniform(0.0, 2 * np.pi)
-            else:
-                theta = 0.0
-
-            if self.kind == "coco":
-                axis = [0, 1, 0]  # y axis
-            elif self.kind == "mpii":
-                axis = [0, 0, 1]  # z axis
-
-            center = torch.from_numpy(base_point).type(torch.float).to(device)
-
-            # rotate
-            coord_volume = coord_volume - center
-            coord_volume = volumetric.rotate_coord_volume(coord_volume, theta, axis)
-            coord_volume = coord_volume + center
-
-            # transfer
-            if self.transfer_cmu_to_human36m:  # different world coordinates
-                coord_volume = coord_volume.permute(0, 2, 1, 3)
-                inv_idx = torch.arange(coord_volume.shape[1] - 1, -1, -1).long().to(device)
-                coord_volume = coord_volume.index_select(1, inv_idx)
+        if self.use_gt_pelvis:
+            keypoints_3d = batch['keypoints_3d'][:, :, :3]  # already stacked by `collate_fn`
+        else:
+            keypoints_3d = np.asarray(batch['pred_keypoints_3d'])[:, :, :3]
+
+        if self.kind == "coco":
+            base_points = (keypoints_3d[:, 11] + keypoints_3d[:, 12]) / 2
+            axis = [0, 1, 0]  # y axis
+        elif self.kind == "mpii":
+            base_points = keypoints_3d[:, 6]
+            axis = [0, 0, 1]  # z axis
+
+        # build cuboids L x L x L
+        sides = np.array([
+            self.cuboid_side, self.cuboid_side, self.cuboid_side
+        ])
+        cuboids = [
+            volumetric.Cuboid3D(base_point - sides / 2, sides)
+            for base_point in base_points
+        ]
+
+        # random rotation
+        if self.training:
+            thetas = np.random.uniform(0.0, 2 * np.pi, size=batch_size)
+        else:
+            thetas = np.zeros(batch_size)
 
-            coord_volumes[batch_i] = coord_volume
+        base_points = torch.from_numpy(base_points).type(torch.float).to(device)
 
         # process features before unprojecting
         features = features.view(-1, *features.shape[2:])
         features = self.process_features(features)
         features = features.view(batch_size, n_views, *features.shape[1:])
 
-        # lift to volume
-        volumes = op.unproject_heatmaps(
-            features,
-            proj_matricies,
-            coord_volumes,
-            volume_aggregation_method=self.volume_aggregation_method,
-            vol_confidences=vol_confidences
-        )  # ~ 0 seconds
-
-        # integral 3d (V2V)
+        # lift to volume and integral 3d (V2V)
         if minimon:
             minimon.enter()
 
-        volumes = self.volume_net(volumes)
-        vol_keypoints_3d, volumes = op.integrate_tensor_3d_with_coordinates(volumes * self.volume_multiplier, coord_volumes, softmax=self.volume_softmax)  # soft-argmax
+        if self.coarse_to_fine:
+            vol_keypoints_3d, volumes, coord_volumes = self._lift_coarse_to_fine(
+                features, proj_matricies, base_points, thetas, axis, vol_confidences
+            )
+        else:
+            coord_volumes = self._build_coord_volumes(
+                base_points, self.cuboid_side, self.volume_size, thetas, axis
+            )
+            volumes = self._lift(features, proj_matricies, coord_volumes, vol_confidences)
+            vol_keypoints_3d, volumes = op.integrate_tensor_3d_with_coordinates(volumes * self.volume_multiplier, coord_volumes, softmax=self.volume_softmax)  # soft-argmax
 
         if minimon:
             minimon.leave('vol: V2V')
@@ -6,7 +6,7 @@ import torch
 from mvn.models.utils import get_grad_params
 from mvn.pipeline.utils import get_kp_gt, backprop
 from mvn.utils.misc import live_debug_log
-from mvn.utils.multiview import triangulate_batch_of_points_in_cam_space,homogeneous_to_euclidean, euclidean_to_homogeneous, prepare_weak_cams_for_dlt
+from mvn.utils.multiview import triangulate_batch_of_points_in_cam_space, prepare_weak_cams_for_dlt
 from mvn.models.loss import GeodesicLoss, KeypointsMSELoss, MSESmoothLoss, KeypointsMSESmoothLoss, ProjectionLoss, ScaleDependentProjectionLoss, PseudoHuberLoss, BerHuLoss, BodyLoss
 from mvn.utils.tred import apply_umeyama
 
@@ -90,30 +90,18 @@ def normalize_keypoints(keypoints_2d, pelvis_center_kps, normalization):
 def _get_cams_gt(cameras, where='world'):
     """ master is 0 """
 
-    n_cameras = len(cameras)
-    batch_size = len(cameras[0])
-
-    cam_gts = torch.zeros(batch_size, n_cameras, 4, 4)
-    for batch_i in range(batch_size):
-        if where == 'world':
-            cam_gts[batch_i] = torch.cat([
-                torch.tensor(
-                    cameras[i][batch_i].extrinsics_padded
-                ).unsqueeze(0)
-                for i in range(n_cameras)
-            ])
-        elif where == 'master':
-            master = torch.tensor(cameras[0][batch_i].extrinsics_padded)
-            from_master = torch.inverse(master)
-
-            cam_gts[batch_i, 0] = master.clone()
-            cam_gts[batch_i, 1:] = torch.cat([
-                torch.mm(
-                    torch.tensor(cameras[i][batch_i].extrinsics_padded),
-                    from_master.clone()
-                ).unsqueeze(0)
-                for i in range(1, n_cameras)
-            ])
+    _to_default = lambda x: x.type(torch.get_default_dtype())
+    extrinsics = _to_default(cameras.extrinsics_padded)  # ~ batch_size, n_cameras, 4, 4
+
+    if where == 'world':
+        cam_gts = extrinsics
+    elif where == 'master':
+        from_master = _to_default(cameras.extrinsics_padded_inv[:, 0])  # rigid => closed-form inverse
+
+        cam_gts = torch.cat([
+            extrinsics[:, :1],
+            extrinsics[:, 1:] @ from_master.unsqueeze(1)
+        ], dim=1)
 
     return cam_gts.cuda()
 
@@ -150,29 +138,25 @@ def triangulate(cams, keypoints_2d_pred, confidences_pred, K, master_cam_i, wher
         where
     )
 
-    # ... perform DLT in master cam space ...
+    # ... perform DLT in master cam space (on the same device of `cams`) ...
+    dev = cams.device
     kps_pred = triangulate_batch_of_points_in_cam_space(
-        full_cams.cpu(),
-        keypoints_2d_pred.cpu(),
-        confidences_batch=confidences_pred.cpu()
-    ).to(keypoints_2d_pred.device)
+        full_cams.to(dev),
+        keypoints_2d_pred.to(dev),
+        confidences_batch=confidences_pred.to(dev)
+    )  # ~ (batch_size, n_joints, 3)
 
     if where == 'world':
         return None, kps_pred
     elif where == 'master':  # ... but since they're in master cam space ...
-        batch_size = cams.shape[0]
-        kps_world_pred = torch.cat([
-            homogeneous_to_euclidean(
-                euclidean_to_homogeneous(
-                    kps_pred[batch_i]
-                ).to(cams.device)
-                @
-                torch.inverse(
-                    cams[batch_i, master_cam_i].T
-                )
-            ).unsqueeze(0)
-            for batch_i in range(batch_size)
-        ])
+        homo = torch.cat([
+            kps_pred,
+            torch.ones_like(kps_pred[..., :1])
+        ], dim=-1)  # ~ (batch_size, n_joints, 4)
+        kps_world_pred = homo @ torch.inverse(
+            cams[:, master_cam_i].transpose(1, 2)
+        ).type(homo.dtype)  # batched
+        kps_world_pred = kps_world_pred[..., :3] / kps_world_pred[..., 3:]
         return kps_pred, kps_world_pred
 
 
@@ -200,7 +184,7 @@ def _compute_losses(cam_preds, cam_gts, confidences_pred, keypoints_2d_pred, kps
     if loss_weights.t > 0:
         total_loss += loss_weights.t * t_loss
 
-    K = torch.tensor(cameras[0][0].intrinsics_padded)  # same for all
+    K = torch.tensor(cameras[0][0].intrinsics_padded).type(torch.get_default_dtype())  # same for all
     loss_proj = ProjectionLoss(
         criterion=KeypointsMSESmoothLoss(threshold=2.0),  # HuberLoss(threshold=1e-1),
         where=config.cam2cam.triangulate
@@ -223,15 +207,9 @@ def _compute_losses(cam_preds, cam_gts, confidences_pred, keypoints_2d_pred, kps
 
     if config.cam2cam.triangulate == 'master':
         extrinsics = torch.cat([
-            torch.cat([
-                torch.mm(
-                    cam_preds[batch_i, i],  # master2i = i * master^-1
-                    cam_preds[batch_i, 0]  # master
-                ).unsqueeze(0) if i > 0 else cam_preds[batch_i, 0].unsqueeze(0)
-                for i in range(n_cameras)
-            ]).unsqueeze(0)
-            for batch_i in range(batch_size)
-        ])
+            cam_preds[:, :1],  # master
+            cam_preds[:, 1:n_cameras] @ cam_preds[:, :1]  # master2i = i * master^-1
+        ], dim=1)  # batched
         _, kps_world_pred_from_exts = triangulate(
             extrinsics, keypoints_2d_pred, confidences_pred, K, 0, 'world'
         )
@@ -382,7 +360,7 @@ def batch_iter(epoch_i, indices, cameras, iter_i, model, cam2cam_model, opt, sch
         cam_preds,
         keypoints_2d_pred,
         confidences_pred,
-        torch.tensor(cameras[0][0].intrinsics_padded).to(cam_preds.device),
+        torch.tensor(cameras[0][0].intrinsics_padded).type(torch.get_default_dtype()).to(cam_preds.device),
         master_i,
         where=config.cam2cam.triangulate
     )
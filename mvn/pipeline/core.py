@@ -10,6 +10,7 @@ from itertools import islice
 
 from mvn.utils.misc import live_debug_log
 from mvn.utils.vis import save_predictions
+from mvn.utils.multiview import project_batch_of_points
 from mvn.datasets.utils import prepare_batch
 from mvn.pipeline.traditional import batch_iter as original_iter
 from mvn.pipeline.dlt_camspace import batch_iter as triangulate_in_cam_iter
@@ -45,31 +46,20 @@ def iter_batch(batch, iter_i, model, model_type, criterion, opt, scheduler, conf
         else:
             results = None
 
-    if config.debug.write_imgs:  # DC, PD, MP only if necessary: breaks num_workers
+    if config.debug.write_imgs and images_batch is not None:  # DC, PD, MP only if necessary: breaks num_workers
         f_out = 'training' if is_train else 'validation'
         f_out += '_batch_{}.png'.format(iter_i)
 
-        batch_size, n_views = images_batch.shape[0], images_batch.shape[1]
-
-        preds = torch.cat([
-            torch.cat([
-                batch['cameras'][view_i][batch_i].world2proj()(
-                    results[batch_i]
-                ).unsqueeze(0)
-                for view_i in range(n_views)
-            ]).unsqueeze(0)  # ~ n_views, 17, 2
-            for batch_i in range(batch_size)
-        ])  # ~ batch_size, n_views, 17, 2
-
-        gts = torch.cat([
-            torch.cat([
-                batch['cameras'][view_i][batch_i].world2proj()(
-                    keypoints_3d_gt[batch_i]
-                ).unsqueeze(0)
-                for view_i in range(n_views)
-            ]).unsqueeze(0)  # ~ n_views, 17, 2
-            for batch_i in range(batch_size)
-        ])  # ~ batch_size, n_views, 17, 2
+        proj_matricies = proj_matricies_batch.detach().cpu()
+        preds = project_batch_of_points(
+            proj_matricies,
+            torch.as_tensor(results).detach().cpu().type(proj_matricies.dtype)
+        )  # ~ batch_size, n_views, 17, 2
+
+        gts = project_batch_of_points(
+            proj_matricies,
+            keypoints_3d_gt.detach().cpu().type(proj_matricies.dtype)
+        )  # ~ batch_size, n_views, 17, 2
 
         save_predictions(
             batch,
@@ -1,25 +1,19 @@
 import torch
 import numpy as np
 
-from mvn.datasets.utils import cam2cam_batch
-from mvn.utils.multiview import euclidean_to_homogeneous
+from mvn.utils.multiview import project_batch_of_points
 from mvn.utils.misc import live_debug_log
 
 
-def batch_iter(batch, iter_i, model, model_type, criterion, opt, images_batch, keypoints_3d_gt, keypoints_3d_binary_validity_gt, is_train, config, minimon):
+def batch_iter(indices, cameras, iter_i, model, model_type, criterion, opt, images_batch, keypoints_3d_gt, keypoints_3d_binary_validity_gt, is_train, config, minimon):
+    """ `cameras` is the (torch, on device) `CameraBatch` returned by `prepare_batch` """
+
     _iter_tag = 'DLT in cam'
 
-    batch_size, n_views = images_batch.shape[0], images_batch.shape[1]
+    batch_size, n_views = cameras.batch_size, cameras.n_views
     master_cams = np.random.randint(0, n_views, size=batch_size)  # choose random "master" cam foreach frame in batch
-    proj_matricies_batch = torch.tensor([
-        [
-            cam2cam_batch(
-                master_cams[batch_i], view_i, batch['cameras'], batch_i
-            )
-            for view_i in range(n_views)
-        ]
-        for batch_i in range(batch_size)
-    ])
+    master_cameras = cameras.select_views(master_cams)  # ~ (batch_size, 1, ...)
+    proj_matricies_batch = cameras.cam2proj(master_cams).type(keypoints_3d_gt.dtype)  # ~ (batch_size, n_views, 3, 4), master cam space -> each view
 
     minimon.enter()
 
@@ -39,40 +33,32 @@ def batch_iter(batch, iter_i, model, model_type, criterion, opt, images_batch, k
 
             scale_keypoints_3d = config.opt.scale_keypoints_3d if hasattr(config.opt, "scale_keypoints_3d") else 1.0
 
-            gt_in_cam = [
-                batch['cameras'][master_cams[batch_i]][batch_i].world2cam()(
-                    keypoints_3d_gt[batch_i].cpu()
-                ).numpy()
-                for batch_i in range(batch_size)
-            ]
+            gt_in_cam = master_cameras.world2cam()(
+                keypoints_3d_gt.type(master_cameras.R.dtype)
+            )[:, 0].type(keypoints_3d_pred.dtype)  # ~ 8, 17, 3
 
             total_loss = criterion(
-                keypoints_3d_pred.cuda() * scale_keypoints_3d,  # ~ 8, 17, 3
-                torch.tensor(gt_in_cam).cuda() * scale_keypoints_3d,  # ~ 8, 17, 3
-                keypoints_3d_binary_validity_gt.cuda()  # ~ 8, 17, 1
+                keypoints_3d_pred * scale_keypoints_3d,  # ~ 8, 17, 3
+                gt_in_cam * scale_keypoints_3d,  # ~ 8, 17, 3
+                keypoints_3d_binary_validity_gt  # ~ 8, 17, 1
             )  # "the loss is 3D pose difference between the obtained 3D pose from DLT and the 3D pose in the first camera space"
         else:  # variant II (2D loss on each view)
             live_debug_log(_iter_tag, 'using variant II (2D loss on each view)')
-            total_loss = 0.0
-
-            for batch_i in range(batch_size):
-                master_cam = batch['cameras'][master_cams[batch_i]][batch_i]
+            n_joints = keypoints_3d_gt.shape[1]
 
-                for view_i in range(n_views):  # todo faster loop
-                    cam = batch['cameras'][view_i][batch_i]
+            gt = cameras.world2proj()(
+                keypoints_3d_gt.detach().type(cameras.R.dtype)
+            ).type(keypoints_3d_pred.dtype)  # ~ 8, 4, 17, 2
+            pred = project_batch_of_points(
+                proj_matricies_batch, keypoints_3d_pred
+            )  # master cam -> each view ~ 8, 4, 17, 2
 
-                    gt = cam.world2proj()(keypoints_3d_gt[batch_i].detach().cpu())  # ~ 17, 2
-                    pred = master_cam.cam2other(cam)(
-                        euclidean_to_homogeneous(
-                            keypoints_3d_pred[batch_i]
-                        )
-                    )  # ~ 17, 2
-
-                    total_loss += criterion(
-                        torch.tensor(pred).unsqueeze(0).cuda(),  # ~ 1, 17, 2
-                        torch.tensor(gt).unsqueeze(0).cuda(),
-                        keypoints_3d_binary_validity_gt[batch_i].unsqueeze(0).cuda()
-                    )  # "The loss is then 2D pose difference between the 2D pose you obtain this way and the GT 2D pose in each view."
+            total_loss = criterion(
+                pred.reshape(-1, n_joints, 2),
+                gt.reshape(-1, n_joints, 2),
+                keypoints_3d_binary_validity_gt.unsqueeze(1).expand(-1, n_views, -1, -1).reshape(-1, n_joints, 1)
+            ) * (batch_size * n_views)  # ~ sum of per-(sample, view) losses
+            # "The loss is then 2D pose difference between the 2D pose you obtain this way and the GT 2D pose in each view."
 
         print('  {} batch iter {:d} loss ~ {:.3f}'.format(
             'training' if is_train else 'validation',
@@ -99,9 +85,6 @@ def batch_iter(batch, iter_i, model, model_type, criterion, opt, images_batch, k
 
     # they're in cam space => cam2world for metric evaluation
     keypoints_3d_pred = keypoints_3d_pred.detach()
-    return torch.cat([
-        batch['cameras'][master_cams[batch_i]][batch_i].cam2world()(
-            keypoints_3d_pred[batch_i]
-        ).unsqueeze(0)
-        for batch_i in range(batch_size)
-    ])
+    return master_cameras.cam2world()(
+        keypoints_3d_pred.unsqueeze(1).type(master_cameras.R.dtype)
+    )[:, 0].type(keypoints_3d_pred.dtype)  # ~ (batch_size, 17, 3)
@@ -7,12 +7,23 @@ from torch.utils.data import DataLoader
 
 from mvn.datasets import human36m
 from mvn.models.utils import build_opt, show_params, load_checkpoint
-from mvn.datasets.utils import worker_init_fn, make_collate_fn
+from mvn.datasets.utils import worker_init_fn, make_collate_fn, EligibleFramesSampler
 from mvn.models.triangulation import RANSACTriangulationNet, AlgebraicTriangulationNet, VolumetricTriangulationNet
 from mvn.models.rototrans import RotoTransNet, Cam2camNet
 from mvn.models.loss import KeypointsMSELoss, KeypointsMSESmoothLoss, KeypointsMAELoss
 
 
+def get_with_images(config):
+    """ GT KPs (cam2cam) => no need for images. An explicit `dataset.with_images` must agree """
+
+    with_images = not (config.model.cam2cam_estimation and config.cam2cam.data.using_gt)
+    if hasattr(config.dataset, "with_images"):
+        assert config.dataset.with_images == with_images, \
+            'dataset.with_images={} but the pipeline needs with_images={}'.format(config.dataset.with_images, with_images)
+
+    return with_images
+
+
 def setup_human36m_dataloaders(config, is_train, distributed_train):
     if is_train:
         train_dataset = human36m.Human36MMultiViewDataset(
@@ -34,10 +45,21 @@ def setup_human36m_dataloaders(config, is_train, distributed_train):
             look_at_pelvis=config.model.cam2cam_estimation and config.cam2cam.data.look_at_pelvis,
             pelvis_in_origin=config.cam2cam.data.pelvis_in_origin,
             scale2meters=config.cam2cam.preprocess.scale2meters,
+            cache_look_at_pelvis=config.cam2cam.data.cache_look_at_pelvis if hasattr(config.cam2cam.data, "cache_look_at_pelvis") else False,
+            with_images=get_with_images(config),
+            crops_cache_dir=config.dataset.train.crops_cache_dir if hasattr(config.dataset.train, "crops_cache_dir") else None,
         )
         print("  training dataset length:", len(train_dataset))
 
-        train_sampler = torch.utils.data.distributed.DistributedSampler(train_dataset) if distributed_train else None
+        if config.cam2cam.data.head_normal:  # draw just frames with head ~ Z
+            train_sampler = EligibleFramesSampler(
+                train_dataset.get_head_normal_indices(min_frames=config.opt.batch_size),
+                shuffle=config.dataset.train.shuffle,
+                distributed=distributed_train
+            )
+            print("  eligible (head normal) training frames:", len(train_sampler.indices))
+        else:
+            train_sampler = torch.utils.data.distributed.DistributedSampler(train_dataset) if distributed_train else None
 
         train_dataloader = DataLoader(
             train_dataset,
@@ -76,6 +98,9 @@ def setup_human36m_dataloaders(config, is_train, distributed_train):
         look_at_pelvis=config.model.cam2cam_estimation and config.cam2cam.data.look_at_pelvis,
         pelvis_in_origin=config.cam2cam.data.pelvis_in_origin,
         scale2meters=config.cam2cam.preprocess.scale2meters,
+        cache_look_at_pelvis=config.cam2cam.data.cache_look_at_pelvis if hasattr(config.cam2cam.data, "cache_look_at_pelvis") else False,
+        with_images=get_with_images(config),
+        crops_cache_dir=config.dataset.val.crops_cache_dir if hasattr(config.dataset.val, "crops_cache_dir") else None,
     )
     print("  validation dataset length:", len(val_dataset))
 
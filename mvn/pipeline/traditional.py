@@ -1,6 +1,7 @@
 from torch import nn
 
 from mvn.models.loss import VolumetricCELoss
+from mvn.utils.multiview import project_batch_of_points
 
 
 def batch_iter(batch, iter_i, model, model_type, criterion, opt, images_batch, keypoints_3d_gt, keypoints_3d_binary_validity_gt, proj_matricies_batch, is_train, config, minimon):
@@ -28,21 +29,22 @@ def batch_iter(batch, iter_i, model, model_type, criterion, opt, images_batch, k
         minimon.enter()
 
         if config.opt.loss_2d:  # ~ 0 seconds
-            batch_size, n_views = images_batch.shape[0], images_batch.shape[1]
+            batch_size, n_views = proj_matricies_batch.shape[0], proj_matricies_batch.shape[1]
             total_loss = 0.0
 
-            for batch_i in range(batch_size):
-                for view_i in range(n_views):  # todo faster (batched) loop
-                    cam = batch['cameras'][view_i][batch_i]
-
-                    gt = cam.world2proj()(keypoints_3d_gt[batch_i])  # ~ 17, 2
-                    pred = cam.world2proj()(
-                        keypoints_3d_pred[batch_i]
-                    )  # ~ 17, 2
+            proj_matricies = proj_matricies_batch.to(keypoints_3d_pred.device)
+            gts = project_batch_of_points(
+                proj_matricies, keypoints_3d_gt.to(keypoints_3d_pred.device)
+            )  # ~ batch_size, n_views, 17, 2
+            preds = project_batch_of_points(
+                proj_matricies, keypoints_3d_pred
+            )  # ~ batch_size, n_views, 17, 2
 
+            for batch_i in range(batch_size):
+                for view_i in range(n_views):
                     total_loss += criterion(
-                        pred.unsqueeze(0).cuda(),  # ~ 1, 17, 2
-                        gt.unsqueeze(0).cuda(),  # ~ 1, 17, 2
+                        preds[batch_i, view_i].unsqueeze(0).cuda(),  # ~ 1, 17, 2
+                        gts[batch_i, view_i].unsqueeze(0).cuda(),  # ~ 1, 17, 2
                         keypoints_3d_binary_validity_gt[batch_i].unsqueeze(0).cuda()  # ~ 1, 17, 1
                     )
         elif config.opt.loss_3d:  # ~ 0 seconds
@@ -4,7 +4,7 @@ from scipy.spatial.transform import Rotation as R
 
 from mvn.models.rototrans import RotoTransCombiner
 from mvn.utils.tred import euler_angles_to_matrix
-from mvn.utils.multiview import _my_proj
+from mvn.utils.multiview import prepare_weak_cams_for_dlt, project_batch_of_points
 from mvn.utils.misc import live_debug_log
 
 
@@ -12,15 +12,11 @@ from mvn.utils.misc import live_debug_log
 def get_kp_gt(keypoints_3d_gt, cameras, use_extra_cams=0, noisy=False):
     batch_size, n_joints, n_views = keypoints_3d_gt.shape[0], keypoints_3d_gt.shape[1], len(cameras)
 
-    keypoints_2d_pred = torch.cat([
-        torch.cat([
-            cameras[view_i][batch_i].world2proj()(
-                keypoints_3d_gt[batch_i].detach().cpu()  # ~ (17, 3)
-            ).unsqueeze(0)
-            for view_i in range(n_views)
-        ]).unsqueeze(0)
-        for batch_i in range(batch_size)
-    ])  # ~ (batch_size, n_views, 17, 2)
+    keypoints_2d_pred = cameras.to(
+        dtype=torch.get_default_dtype()
+    ).world2proj()(
+        keypoints_3d_gt.detach().cpu().type(torch.get_default_dtype())  # ~ (batch_size, 17, 3)
+    )  # ~ (batch_size, n_views, 17, 2)
 
     if use_extra_cams > 0:
         convention = 'zxy'  # https://en.wikipedia.org/wiki/Euler_angles
@@ -43,17 +39,14 @@ def get_kp_gt(keypoints_3d_gt, cameras, use_extra_cams=0, noisy=False):
             Rs.unsqueeze(0),  # batched ...
             torch.tensor(distances).view(1, use_extra_cams, 1)
         )[0]
-        K = torch.tensor(cameras[0][0].intrinsics_padded)  # same for all
-
-        fakes = torch.cat([
-            torch.cat([
-                _my_proj(Rts[fake_i], K)(
-                    keypoints_3d_gt[batch_i].detach().cpu()  # ~ (17, 3)
-                ).unsqueeze(0)
-                for fake_i in range(len(Rts))
-            ]).unsqueeze(0)
-            for batch_i in range(batch_size)
-        ])
+        K = torch.tensor(cameras[0][0].intrinsics_padded).type(torch.get_default_dtype())  # same for all
+
+        fakes = project_batch_of_points(
+            prepare_weak_cams_for_dlt(
+                Rts.unsqueeze(0).type(torch.get_default_dtype()), K
+            ),  # ~ (1, |eulers|, 3, 4), broadcasted over batch
+            keypoints_3d_gt.detach().cpu().type(torch.get_default_dtype())  # ~ (batch_size, 17, 3)
+        )  # ~ (batch_size, |eulers|, 17, 2)
         keypoints_2d_pred = torch.cat([
             keypoints_2d_pred,
             fakes,
@@ -112,6 +112,109 @@ def normalize_image(image):
     return (image / 255.0 - IMAGENET_MEAN) / IMAGENET_STD
 
 
+IMAGENET_MEAN_F32, IMAGENET_STD_F32 = IMAGENET_MEAN.astype(np.float32), IMAGENET_STD.astype(np.float32)
+
+_REDUCED_COLOR_FLAGS = {
+    1: cv2.IMREAD_COLOR,
+    2: cv2.IMREAD_REDUCED_COLOR_2,
+    4: cv2.IMREAD_REDUCED_COLOR_4,
+    8: cv2.IMREAD_REDUCED_COLOR_8,
+}
+
+
+def normalize_image_f32(image):
+    """ = normalize_image, but in float32 (half the memory traffic) """
+
+    image = image.astype(np.float32) * np.float32(1.0 / 255.0)
+    return (image - IMAGENET_MEAN_F32) / IMAGENET_STD_F32
+
+
+def crop_image_np(image, bbox):
+    """ = crop_image (out-of-image area is filled with zeros), without going through PIL
+
+    Args:
+        image numpy array of shape (height, width, ...): input image
+        bbox tuple of size 4: input bbox (left, upper, right, lower), integers
+
+    Returns:
+        cropped_image numpy array of shape (lower - upper, right - left, ...)
+    """
+
+    left, upper, right, lower = bbox
+    height, width = image.shape[:2]
+
+    cropped = np.zeros((lower - upper, right - left) + image.shape[2:], dtype=image.dtype)
+
+    src_left, src_upper = max(left, 0), max(upper, 0)
+    src_right, src_lower = min(right, width), min(lower, height)
+    if src_right > src_left and src_lower > src_upper:
+        cropped[
+            src_upper - upper: src_lower - upper,
+            src_left - left: src_right - left
+        ] = image[src_upper: src_lower, src_left: src_right]
+
+    return cropped
+
+
+def get_jpeg_reduction(bbox, shape):
+    """ largest JPEG decode reduction (1, 2, 4, 8) s.t the reduced `bbox` is still at least as large as the target `shape` """
+
+    left, upper, right, lower = bbox
+    bbox_height, bbox_width = lower - upper, right - left
+
+    reduction = 1
+    for candidate in (2, 4, 8):
+        if bbox_height // candidate >= shape[0] and bbox_width // candidate >= shape[1]:
+            reduction = candidate
+
+    return reduction
+
+
+def get_reduced_bbox(bbox, reduction):
+    """ `bbox` (left, upper, right, lower) in the image decoded at 1 / `reduction` scale: (left, upper) down, (right, lower) up """
+
+    return tuple(
+        int(np.floor(x / reduction)) if i < 2 else int(np.ceil(x / reduction))
+        for i, x in enumerate(bbox)
+    )
+
+
+def get_effective_bbox(bbox, shape):
+    """ full-resolution bbox actually cropped by `load_crop_resize_image(..., bbox, shape)` (i.e the reduced one, scaled back): cameras must be updated with this one """
+
+    reduction = get_jpeg_reduction(bbox, shape)
+    return tuple(
+        x * reduction
+        for x in get_reduced_bbox(bbox, reduction)
+    )
+
+
+def load_crop_resize_image(image_path, bbox, shape, normalize=True):
+    """ fused `cv2.imread` -> `crop_image` -> `resize_image` -> `normalize_image`: decodes at reduced scale when `bbox` allows, crops in uint8, resizes once and normalizes in float32
+
+    Args:
+        bbox tuple of size 4: (left, upper, right, lower) in full-resolution image coordinates (the one actually cropped is `get_effective_bbox(bbox, shape)`)
+        shape: (height, width) of the output
+        normalize: if False, the uint8 crop is returned (=> normalize on the device)
+
+    Returns:
+        image numpy array of shape (height, width, 3), float32 (if `normalize`) else uint8. None if decoding failed
+    """
+
+    reduction = get_jpeg_reduction(bbox, shape)
+    image = cv2.imread(image_path, _REDUCED_COLOR_FLAGS[reduction])
+    if image is None:
+        return None
+
+    image = crop_image_np(image, get_reduced_bbox(bbox, reduction))
+    image = resize_image(image, shape)
+
+    if normalize:
+        image = normalize_image_f32(image)
+
+    return image
+
+
 def denormalize_image(image):
     """Reverse to normalize_image() function"""
     return np.clip(255.0 * (image * IMAGENET_STD + IMAGENET_MEAN), 0, 255)
@@ -230,6 +333,37 @@ def rotation_matrix_from_vectors_rodrigues(vec1, vec2):
     return np.eye(3) + kmat + kmat.dot(kmat) * ((1 - c) / (s ** 2))  # 3 x 3
 
 
+def rotation_matrices_from_vectors_rodrigues(vecs1, vecs2):
+    """ = rotation_matrix_from_vectors_rodrigues, batched
+
+    Args:
+        vecs1 numpy array of shape (N, 3): vectors to rotate
+        vecs2 numpy array of shape (N, 3) or (3,): target directions
+
+    Returns:
+        numpy array of shape (N, 3, 3): rotation matricies
+    """
+
+    vecs1, vecs2 = np.asarray(vecs1, dtype=np.float64), np.asarray(vecs2, dtype=np.float64)
+    a = vecs1 / np.linalg.norm(vecs1, axis=-1, keepdims=True)
+    b = np.broadcast_to(
+        vecs2 / np.linalg.norm(vecs2, axis=-1, keepdims=True), a.shape
+    )
+
+    v = np.cross(a, b)
+    c = np.einsum('ni,ni->n', a, b)
+
+    zeros = np.zeros_like(c)
+    kmat = np.stack([
+        np.stack([zeros, -v[:, 2], v[:, 1]], axis=-1),
+        np.stack([v[:, 2], zeros, -v[:, 0]], axis=-1),
+        np.stack([-v[:, 1], v[:, 0], zeros], axis=-1)
+    ], axis=-2)  # ~ N, 3, 3
+
+    # (1 - c) / s ** 2 = 1 / (1 + c) => stable when already aligned
+    return np.eye(3) + kmat + (kmat @ kmat) / (1 + c)[:, None, None]
+
+
 def rotation_matrix_from_vectors_kabsch(vec1, vec2):
     """ https://github.com/scipy/scipy/blob/master/scipy/spatial/transform/rotation.pyx#L2204 """
 
@@ -1,3 +1,5 @@
+from itertools import combinations
+
 import numpy as np
 import torch
 
@@ -43,7 +45,11 @@ def homogeneous_to_euclidean(points):
 
 # todo refactor using fs like _myproj ...
 class Camera:
+    """ matricies (extrinsics, projection ...) are computed lazily and cached until R, t or K change. NOTE: assign R, t, K (or use the `update_*` / `scale_*` methods), do not modify them in-place """
+
     def __init__(self, R, t, K, dist=None, name=""):
+        self._cache = {}
+
         self.R = np.array(R).copy()  # 3 x 3
 
         self.t = np.array(t).copy()
@@ -57,6 +63,47 @@ class Camera:
 
         self.name = name
 
+    def __getstate__(self):  # do not pickle cached matricies
+        state = self.__dict__.copy()
+        state['_cache'] = {}
+        return state
+
+    def _invalidate(self):
+        self._cache.clear()
+
+    def _cached(self, key, f):
+        if key not in self._cache:
+            self._cache[key] = f()
+
+        return self._cache[key]
+
+    @property
+    def R(self):
+        return self._R
+
+    @R.setter
+    def R(self, value):
+        self._R = value
+        self._invalidate()
+
+    @property
+    def t(self):
+        return self._t
+
+    @t.setter
+    def t(self, value):
+        self._t = value
+        self._invalidate()
+
+    @property
+    def K(self):
+        return self._K
+
+    @K.setter
+    def K(self, value):
+        self._K = value
+        self._invalidate()
+
     def update_after_crop(self, bbox):
         left, upper, _, _ = bbox  # unpack
 
@@ -66,6 +113,7 @@ class Camera:
         new_cy = cy - upper
 
         self.K[0, 2], self.K[1, 2] = new_cx, new_cy
+        self._invalidate()
 
     def update_after_resize(self, image_shape, new_image_shape):
         height, width = image_shape  # original image resolution
@@ -79,6 +127,7 @@ class Camera:
         new_cy = cy * (new_height / height)
 
         self.K[0, 0], self.K[1, 1], self.K[0, 2], self.K[1, 2] = new_fx, new_fy, new_cx, new_cy
+        self._invalidate()
 
     def update_extrinsics(self, Rt):
         E = Rt.copy().dot(self.extrinsics)
@@ -88,39 +137,64 @@ class Camera:
     def scale_K(self, scaling):
         self.K[0, 0] /= scaling
         self.K[1, 1] /= scaling
+        self._invalidate()
 
     def scale_extrinsics(self, scaling):
         self.t /= scaling
+        self._invalidate()
 
     @property
     def extrinsics(self):  # 3D world -> 3D camera space
-        return np.hstack([self.R, self.t])  # ~ 3 x 4 (rotation 3 x 3 + translation 3 x 1)
+        return self._cached(
+            'extrinsics',
+            lambda: np.hstack([self.R, self.t])
+        )  # ~ 3 x 4 (rotation 3 x 3 + translation 3 x 1)
 
     @property
     def projection(self):  # 3D world -> 3D camera space -> 2D camera
-        return self.K.dot(self.extrinsics)  # ~ 3 x 4
+        return self._cached(
+            'projection',
+            lambda: self.K.dot(self.extrinsics)
+        )  # ~ 3 x 4
 
     @property
     def extrinsics_padded(self):
-        return np.vstack([
-            self.extrinsics,
-            [0, 0, 0, 1]
-        ])  # ~ 4 x 4, to allow inverse
-    
+        return self._cached(
+            'extrinsics_padded',
+            lambda: np.vstack([
+                self.extrinsics,
+                [0, 0, 0, 1]
+            ])
+        )  # ~ 4 x 4, to allow inverse
+
+    @property
+    def extrinsics_padded_inv(self):
+        def _f():
+            R_inv = self.R.T
+            return np.vstack([
+                np.hstack([R_inv, -R_inv.dot(self.t)]),
+                [0, 0, 0, 1]
+            ])
+
+        return self._cached('extrinsics_padded_inv', _f)  # ~ 4 x 4, closed-form inverse of rigid [R | t]
+
     @property
     def intrinsics_padded(self):
-        return np.hstack([
-            self.K,
-            np.expand_dims(np.zeros(3), axis=0).T
-        ])  # 3 x 4
+        return self._cached(
+            'intrinsics_padded',
+            lambda: np.hstack([
+                self.K,
+                np.expand_dims(np.zeros(3), axis=0).T
+            ])
+        )  # 3 x 4
 
-    def cam2world(self):  # todo faster by .T
+    def cam2world(self):
         """ 3D camera space (3D, x y z 1) -> 3D world (euclidean) """
 
         def _f(x):
             homo = euclidean_to_homogeneous(x)  # [x y z] -> [x y z 1]
-            inv = torch.inverse(torch.tensor(self.extrinsics_padded.T))  # N x 4
-            eucl = homo.type @ inv
+            inv = torch.tensor(self.extrinsics_padded_inv.T).to(homo.device).type(homo.dtype)  # 4 x 4
+            eucl = homo @ inv
             return homogeneous_to_euclidean(eucl)  # N x 4 -> N x 3
 
         return _f
@@ -179,7 +253,7 @@ class Camera:
         """ 3D camera space (4D, x y z 1) -> 3D world (homo) -> 3D other camera space (4D, x y z 1) """
         
         def _f(x):
-            inv = torch.inverse(torch.tensor(self.extrinsics_padded.T))  # todo faster by .T
+            inv = torch.tensor(self.extrinsics_padded_inv.T)
             back2world = x @ inv  # N x 4
             return back2world @ torch.tensor(other.extrinsics_padded.T)  # N x 4
 
@@ -198,6 +272,233 @@ class Camera:
         )
 
 
+def _is_torch(x):
+    return torch.is_tensor(x)
+
+
+def _transpose(x):
+    return x.transpose(-1, -2) if _is_torch(x) else np.swapaxes(x, -1, -2)
+
+
+def _cat(xs, axis):
+    return torch.cat(xs, dim=axis) if _is_torch(xs[0]) else np.concatenate(xs, axis=axis)
+
+
+def _pad_rows(m):
+    """ (..., 3, 4) -> (..., 4, 4) by appending [0, 0, 0, 1] """
+
+    if _is_torch(m):
+        last_row = torch.zeros(*m.shape[:-2], 1, 4, dtype=m.dtype, device=m.device)
+    else:
+        last_row = np.zeros(m.shape[:-2] + (1, 4), dtype=m.dtype)
+
+    last_row[..., 0, 3] = 1
+    return _cat([m, last_row], -2)
+
+
+class CameraBatch:
+    """ = Camera but stacked: R, t, K (and dist) are arrays of shape (batch_size, n_views, ...), either numpy or torch.
+
+    For compatibility with the (n_views x batch_size) lists of Camera, `cameras[view_i][batch_i]` still returns a (new) Camera.
+    """
+
+    def __init__(self, R, t, K, dist=None, names=None):
+        self.R = R  # ~ batch_size, n_views, 3, 3
+        self.t = t.reshape(*R.shape[:2], 3, 1)  # ~ batch_size, n_views, 3, 1
+        self.K = K  # ~ batch_size, n_views, 3, 3
+        self.dist = dist  # ~ batch_size, n_views, 5
+        self.names = names  # ~ n_views
+
+    @staticmethod
+    def from_cameras(cameras):
+        """ cameras: list (batch_size) of lists (n_views) of Camera """
+
+        def _stack(attr):
+            return np.stack([
+                np.stack([getattr(camera, attr) for camera in sample_cameras])
+                for sample_cameras in cameras
+            ])
+
+        has_dist = all(
+            camera.dist is not None
+            for sample_cameras in cameras
+            for camera in sample_cameras
+        )
+
+        return CameraBatch(
+            _stack('R'),
+            _stack('t'),
+            _stack('K'),
+            _stack('dist') if has_dist else None,
+            [camera.name for camera in cameras[0]]
+        )
+
+    @property
+    def batch_size(self):
+        return self.R.shape[0]
+
+    @property
+    def n_views(self):
+        return self.R.shape[1]
+
+    def __len__(self):  # as the list of views of Camera
+        return self.n_views
+
+    def __getitem__(self, view_i):
+        return _CameraBatchView(self, view_i)
+
+    def get_camera(self, batch_i, view_i):
+        _np = lambda x: x.detach().cpu().numpy() if _is_torch(x) else x
+
+        return Camera(
+            _np(self.R[batch_i, view_i]),
+            _np(self.t[batch_i, view_i]),
+            _np(self.K[batch_i, view_i]),
+            None if self.dist is None else _np(self.dist[batch_i, view_i]),
+            self.names[view_i] if self.names else ""
+        )
+
+    def select(self, batch_indices):
+        """ subset of samples (indices or boolean mask) """
+
+        return CameraBatch(
+            self.R[batch_indices],
+            self.t[batch_indices],
+            self.K[batch_indices],
+            None if self.dist is None else self.dist[batch_indices],
+            self.names
+        )
+
+    def select_views(self, view_indices):
+        """ one view foreach sample (`view_indices` ~ (batch_size,)) => n_views = 1 """
+
+        batch_indices = np.arange(self.batch_size)
+        _select = lambda x: x[batch_indices, view_indices][:, None]
+
+        return CameraBatch(
+            _select(self.R),
+            _select(self.t),
+            _select(self.K),
+            None if self.dist is None else _select(self.dist)
+        )
+
+    def copy(self):
+        _copy = lambda x: x.clone() if _is_torch(x) else x.copy()
+
+        return CameraBatch(
+            _copy(self.R),
+            _copy(self.t),
+            _copy(self.K),
+            None if self.dist is None else _copy(self.dist),
+            self.names
+        )
+
+    def to(self, device='cpu', dtype=torch.float):
+        """ -> torch tensors on `device` """
+
+        _to = lambda x: (x if _is_torch(x) else torch.from_numpy(np.ascontiguousarray(x))).to(device=device, dtype=dtype)
+
+        return CameraBatch(
+            _to(self.R),
+            _to(self.t),
+            _to(self.K),
+            None if self.dist is None else _to(self.dist),
+            self.names
+        )
+
+    def update_after_resize(self, image_shape, new_image_shape):
+        height, width = image_shape  # original image resolution
+        new_height, new_width = new_image_shape
+
+        for row, col, scaling in [
+            (0, 0, new_width / width),  # fx
+            (1, 1, new_height / height),  # fy
+            (0, 2, new_width / width),  # cx
+            (1, 2, new_height / height),  # cy
+        ]:
+            self.K[..., row, col] = self.K[..., row, col] * scaling
+
+    @property
+    def extrinsics(self):  # 3D world -> 3D camera space
+        return _cat([self.R, self.t], -1)  # ~ batch_size, n_views, 3, 4
+
+    @property
+    def projection(self):  # 3D world -> 3D camera space -> 2D camera
+        return self.K @ self.extrinsics  # ~ batch_size, n_views, 3, 4
+
+    @property
+    def extrinsics_padded(self):
+        return _pad_rows(self.extrinsics)  # ~ batch_size, n_views, 4, 4
+
+    @property
+    def extrinsics_padded_inv(self):
+        """ closed-form inverse of rigid [R | t] => [R.T | -R.T t] """
+
+        R_inv = _transpose(self.R)
+        return _pad_rows(_cat([R_inv, -(R_inv @ self.t)], -1))  # ~ batch_size, n_views, 4, 4
+
+    @property
+    def intrinsics_padded(self):
+        zeros = torch.zeros_like(self.t) if _is_torch(self.t) else np.zeros_like(self.t)
+        return _cat([self.K, zeros], -1)  # ~ batch_size, n_views, 3, 4
+
+    def world2cam(self):
+        """ 3D world (batch_size, N, 3) -> 3D camera space of each view (batch_size, n_views, N, 3) """
+
+        def _f(x):
+            return project_batch_of_points(
+                self.extrinsics, x, convert_back_to_euclidean=False
+            )
+
+        return _f
+
+    def world2proj(self):
+        """ 3D world (batch_size, N, 3) -> 2D image of each view (batch_size, n_views, N, 2) """
+
+        def _f(x):
+            return project_batch_of_points(self.projection, x)
+
+        return _f
+
+    def cam2world(self):
+        """ 3D camera space of each view (batch_size, n_views, N, 3) -> 3D world (batch_size, n_views, N, 3) """
+
+        def _f(x):
+            return (x - _transpose(self.t)) @ self.R  # R.T (x - t), row-wise
+
+        return _f
+
+    def cam2cam(self, src_views):
+        """ (batch_size, 4, 4) matricies: 3D camera space of `src_views[batch_i]` -> 3D camera space of each view ~ (batch_size, n_views, 4, 4) """
+
+        batch_indices = np.arange(self.batch_size)
+        from_src = self.extrinsics_padded_inv[batch_indices, src_views]  # ~ batch_size, 4, 4
+        return self.extrinsics_padded @ from_src[:, None]
+
+    def cam2proj(self, src_views):
+        """ = cam2cam, then project => (batch_size, n_views, 3, 4) matricies """
+
+        return self.intrinsics_padded @ self.cam2cam(src_views)
+
+
+class _CameraBatchView:
+    """ cameras of a single view, for all samples in batch """
+
+    def __init__(self, camera_batch, view_i):
+        self.camera_batch = camera_batch
+        self.view_i = view_i
+
+    def __len__(self):
+        return self.camera_batch.batch_size
+
+    def __getitem__(self, batch_i):
+        return self.camera_batch.get_camera(batch_i, self.view_i)
+
+    def __iter__(self):
+        for batch_i in range(len(self)):
+            yield self[batch_i]
+
+
 def build_intrinsics(translation=(0, 0), f=(1, 1), shear=1):
     return np.array([
         [f[0], shear / f[0], translation[0]],
@@ -228,6 +529,86 @@ def project_3d_points_to_image_plane_without_distortion(proj_matrix, points_3d,
         return result
 
 
+def rescale_proj_matricies(proj_matricies_batch, image_shape, new_image_shape):
+    """ = Camera.update_after_resize, but on already stacked projection matricies: P' = diag(sx, sy, 1) @ P
+
+    Args:
+        proj_matricies_batch torch tensor of shape (..., 3, 4): projection matricies at `image_shape` resolution
+        image_shape, new_image_shape: (height, width)
+
+    Returns:
+        torch tensor of shape (..., 3, 4): projection matricies at `new_image_shape` resolution
+    """
+
+    height, width = image_shape
+    new_height, new_width = new_image_shape
+
+    scaling = proj_matricies_batch.new_tensor([
+        new_width / width, new_height / height, 1.0
+    ]).view(3, 1)  # diagonal scaling matrix => row-wise multiply
+    return proj_matricies_batch * scaling
+
+
+def project_batch_of_points(proj_matricies_batch, points_3d_batch, convert_back_to_euclidean=True):
+    """ = project_3d_points_to_image_plane_without_distortion but for many views (and samples) at once, in either numpy or PyTorch (no host <-> device round-trips)
+
+    Args:
+        proj_matricies_batch numpy array or torch tensor of shape (..., n_views, 3, 4): projection matricies
+        points_3d_batch numpy array or torch tensor of shape (..., n_points, 3): 3D points (leading dimensions are broadcasted with the ones of `proj_matricies_batch`)
+
+    Returns:
+        numpy array or torch tensor of shape (..., n_views, n_points, 2): 3D points projected to image plane of each view
+    """
+
+    if isinstance(proj_matricies_batch, np.ndarray) and isinstance(points_3d_batch, np.ndarray):
+        homo = np.concatenate([
+            points_3d_batch,
+            np.ones(points_3d_batch.shape[:-1] + (1,), dtype=points_3d_batch.dtype)
+        ], axis=-1)
+        result = np.expand_dims(homo, -3) @ np.swapaxes(proj_matricies_batch, -1, -2)
+    elif torch.is_tensor(proj_matricies_batch) and torch.is_tensor(points_3d_batch):
+        homo = torch.cat([
+            points_3d_batch,
+            torch.ones(
+                *points_3d_batch.shape[:-1], 1,
+                dtype=points_3d_batch.dtype, device=points_3d_batch.device
+            )
+        ], dim=-1)
+        result = homo.unsqueeze(-3) @ proj_matricies_batch.type(homo.dtype).transpose(-1, -2)
+    else:
+        raise ValueError("Cannot mix numpy and torch")
+
+    if convert_back_to_euclidean:
+        result = result[..., :2] / result[..., 2:]
+
+    return result  # ~ (..., n_views, n_points, 2)
+
+
+def calc_reprojection_error_batch(proj_matricies_batch, keypoints_3d_batch, keypoints_2d_batch, reprojection_error_epsilon=15):
+    """Reprojection errors of 3D keypoints in all views (and samples) at once, in either numpy or PyTorch
+
+    Args:
+        proj_matricies_batch numpy array or torch tensor of shape (..., n_views, 3, 4): projection matricies
+        keypoints_3d_batch numpy array or torch tensor of shape (..., n_joints, 3): 3D keypoints
+        keypoints_2d_batch numpy array or torch tensor of shape (..., n_views, n_joints, 2): 2D keypoints
+        reprojection_error_epsilon float: views with reprojection error below it are inliers
+
+    Returns:
+        reprojection_errors numpy array or torch tensor of shape (..., n_views, n_joints): as in `calc_reprojection_error_matrix`
+        inliers_mask bool numpy array or torch tensor of shape (..., n_views, n_joints)
+    """
+
+    projected = project_batch_of_points(proj_matricies_batch, keypoints_3d_batch)
+    diff = keypoints_2d_batch - projected
+
+    if torch.is_tensor(diff):
+        reprojection_errors = 1 / 2 * torch.norm(diff, dim=-1)
+    else:
+        reprojection_errors = 1 / 2 * np.sqrt(np.sum(diff ** 2, axis=-1))
+
+    return reprojection_errors, reprojection_errors < reprojection_error_epsilon
+
+
 def triangulate_point_from_multiple_views_linear(proj_matricies, points, convert_to_euclidean=True):  # todo use confidences
     """Triangulates one point from multiple (N) views using direct linear transformation (DLT). For more information look at "Multiple view geometry in computer vision", Richard Hartley and Andrew Zisserman, 12.2 (p. 312).
 
@@ -385,7 +766,16 @@ def triangulate_points_in_camspace(points_batch, matrices_batch, confidences_bat
     return point_3d_batch
 
 
-def triangulate_batch_of_points_in_cam_space(matrices_batch, points_batch, triangulator=triangulate_points_in_camspace, confidences_batch=None):
+def triangulate_batch_of_points_in_cam_space(matrices_batch, points_batch, triangulator=None, confidences_batch=None):
+    """ matrices (batch_size, n_views, 3, 4), keypoints 2D (batch_size, n_views, n_joints, 2), confidences. By default (`triangulator` is None) all samples and joints are triangulated at once on the same device of the inputs, else `triangulator` (e.g `triangulate_points_in_camspace`) is called foreach sample """
+
+    if triangulator is None:
+        return triangulate_batch_of_points_linear(
+            matrices_batch,
+            points_batch,
+            confidences_batch=confidences_batch
+        )  # ~ (batch_size, n_joints, 3)
+
     batch_size = points_batch.shape[0]
     return torch.cat([
         triangulator(
@@ -430,14 +820,291 @@ def triangulate_batch_of_points(proj_matricies_batch, points_batch, triangulator
     return point_3d_batch
 
 
+def build_dlt_system_batch(proj_matricies_batch, points_batch, confidences_batch=None, views_mask=None):
+    """Assembles DLT linear systems for all samples and joints at once
+
+    Args:
+        proj_matricies_batch torch tensor of shape (batch_size, n_views, 3, 4): projection matricies
+        points_batch torch tensor of shape (batch_size, n_views, n_joints, 2): points' coordinates
+        confidences_batch None or torch tensor of shape (batch_size, n_views, n_joints): confidences of points
+        views_mask None or bool torch tensor of shape (batch_size, n_views) or (batch_size, n_views, n_joints): False => view is ignored
+
+    Returns:
+        A torch tensor of shape (batch_size, n_joints, 2 * n_views, 4): one DLT system per joint
+    """
+
+    batch_size, n_views, n_joints = points_batch.shape[:3]
+    proj_matricies_batch = proj_matricies_batch.type(points_batch.dtype)
+
+    A = proj_matricies_batch[:, :, None, 2:3] * points_batch.unsqueeze(-1)  # ~ (batch_size, n_views, n_joints, 2, 4)
+    A = A - proj_matricies_batch[:, :, None, :2]
+
+    weights = None
+    if not (confidences_batch is None):
+        weights = confidences_batch.type(A.dtype)
+
+    if not (views_mask is None):
+        if views_mask.dim() == 2:  # same mask for all joints
+            views_mask = views_mask.unsqueeze(-1).expand(batch_size, n_views, n_joints)
+
+        views_mask = views_mask.type(A.dtype)
+        weights = views_mask if weights is None else weights * views_mask
+
+    if not (weights is None):
+        A = A * weights.view(batch_size, n_views, n_joints, 1, 1)  # masked rows => 0s, they do not affect the solution
+
+    return A.permute(0, 2, 1, 3, 4).reshape(batch_size, n_joints, 2 * n_views, 4)
+
+
+def triangulate_batch_of_points_linear(proj_matricies_batch, points_batch, confidences_batch=None, views_mask=None, convert_to_euclidean=True):
+    """ = triangulate_point_from_multiple_views_linear_torch but for all (batch, joint) pairs with a single batched SVD
+
+    Args:
+        proj_matricies_batch torch tensor of shape (batch_size, n_views, 3, 4): projection matricies
+        points_batch torch tensor of shape (batch_size, n_views, n_joints, 2): points' coordinates
+        confidences_batch None or torch tensor of shape (batch_size, n_views, n_joints): confidences of points. If None, all confidences are supposed to be 1.0
+        views_mask None or bool torch tensor of shape (batch_size, n_views) or (batch_size, n_views, n_joints): use it when views are missing (at least 2 must be valid)
+
+    Returns:
+        point_3d_batch torch tensor of shape (batch_size, n_joints, 3): triangulated points (or (..., 4) homogeneous ones if not `convert_to_euclidean`)
+    """
+
+    A = build_dlt_system_batch(
+        proj_matricies_batch, points_batch, confidences_batch, views_mask
+    )  # ~ (batch_size, n_joints, 2 * n_views, 4)
+
+    _, _, vh = torch.svd(A)  # one batched SVD, V ~ (batch_size, n_joints, 4, 4)
+    point_3d_batch = -vh[..., 3]  # singular vector of the smallest singular value
+
+    if convert_to_euclidean:
+        point_3d_batch = point_3d_batch[..., :3] / point_3d_batch[..., 3:]
+
+    return point_3d_batch  # ~ (batch_size, n_joints, 3)
+
+
+def smallest_eigenvector_eigh(M):
+    """Eigenvector of the smallest eigenvalue of (a batch of) symmetric matrices
+
+    Args:
+        M torch tensor of shape (..., N, N): symmetric matricies
+
+    Returns:
+        torch tensor of shape (..., N): unit eigenvectors
+    """
+
+    if hasattr(torch, 'linalg') and hasattr(torch.linalg, 'eigh'):
+        _, eigenvectors = torch.linalg.eigh(M)
+    else:  # old PyTorch
+        _, eigenvectors = torch.symeig(M, eigenvectors=True)
+
+    return eigenvectors[..., 0]  # eigenvalues are sorted in ascending order
+
+
+def smallest_eigenvector_jacobi(M, n_sweeps=5, eps=1e-12):
+    """ = smallest_eigenvector_eigh but with a fixed number of cyclic Jacobi sweeps: deterministic, differentiable and fully tensorized (for tiny N, e.g 4 x 4 DLT normal equations)
+
+    Args:
+        M torch tensor of shape (..., N, N): symmetric matricies
+        n_sweeps int: each sweep zeroes all N * (N - 1) / 2 off-diagonal entries once
+
+    Returns:
+        torch tensor of shape (..., N): unit eigenvectors
+    """
+
+    batch_shape, n = M.shape[:-2], M.shape[-1]
+    M = M.reshape(-1, n, n)
+    V = torch.eye(n, dtype=M.dtype, device=M.device).unsqueeze(0).repeat(M.shape[0], 1, 1)
+
+    for _ in range(n_sweeps):
+        for p in range(n - 1):
+            for q in range(p + 1, n):
+                a_pq = M[:, p, q]
+                diff = M[:, q, q] - M[:, p, p]
+
+                is_rotating = a_pq.abs() > eps  # avoid atan2(0, 0) => NaN grads
+                theta = 0.5 * torch.atan2(
+                    2 * torch.where(is_rotating, a_pq, torch.ones_like(a_pq)),
+                    torch.where(is_rotating, diff, torch.ones_like(diff))
+                )
+                theta = torch.where(is_rotating, theta, torch.zeros_like(theta))
+                c, s = torch.cos(theta), torch.sin(theta)
+
+                J = torch.eye(n, dtype=M.dtype, device=M.device).unsqueeze(0).repeat(M.shape[0], 1, 1)
+                J[:, p, p], J[:, q, q] = c, c
+                J[:, p, q], J[:, q, p] = s, -s
+
+                M = J.transpose(1, 2) @ M @ J  # zeroes M[p, q]
+                V = V @ J
+
+    smallest = torch.argmin(torch.diagonal(M, dim1=1, dim2=2), dim=-1)  # ~ (batch,)
+    eigenvector = torch.gather(
+        V, 2, smallest.view(-1, 1, 1).expand(-1, n, 1)
+    ).squeeze(-1)
+
+    return eigenvector.reshape(*batch_shape, n)
+
+
+def triangulate_batch_of_points_normal_equations(proj_matricies_batch, points_batch, confidences_batch=None, views_mask=None, method='eigh', convert_to_euclidean=True):
+    """ = triangulate_batch_of_points_linear but solving the 4 x 4 normal equations (AᵀA, built and solved in float64) for all (batch, joint) pairs at once. Unlike `triangulate_from_multiple_views_sii` there is no random start, hence results are deterministic.
+
+    Args:
+        method str: 'eigh' (batched symmetric eigensolver) or 'jacobi' (see `smallest_eigenvector_jacobi`)
+
+    Returns:
+        point_3d_batch torch tensor of shape (batch_size, n_joints, 3): triangulated points
+    """
+
+    A = build_dlt_system_batch(
+        proj_matricies_batch, points_batch, confidences_batch, views_mask
+    )  # ~ (batch_size, n_joints, 2 * n_views, 4)
+    A64 = A.double()  # AᵀA squares the condition number => float32 is not enough
+    AtA = A64.transpose(-2, -1) @ A64  # ~ (batch_size, n_joints, 4, 4)
+
+    if method == 'eigh':
+        point_3d_batch = smallest_eigenvector_eigh(AtA)
+    elif method == 'jacobi':
+        point_3d_batch = smallest_eigenvector_jacobi(AtA)
+    else:
+        raise ValueError("Unknown method: {}".format(method))
+
+    if convert_to_euclidean:
+        point_3d_batch = point_3d_batch[..., :3] / point_3d_batch[..., 3:]
+
+    return point_3d_batch.type(A.dtype)  # ~ (batch_size, n_joints, 3)
+
+
 def calc_reprojection_error_matrix(keypoints_3d, keypoints_2d_list, proj_matricies):
-    reprojection_error_matrix = []
-    for keypoints_2d, proj_matrix in zip(keypoints_2d_list, proj_matricies):
-        keypoints_2d_projected = project_3d_points_to_image_plane_without_distortion(proj_matrix, keypoints_3d)
-        reprojection_error = 1 / 2 * np.sqrt(np.sum((keypoints_2d - keypoints_2d_projected) ** 2, axis=1))
-        reprojection_error_matrix.append(reprojection_error)
+    reprojection_errors, _ = calc_reprojection_error_batch(
+        np.asarray(proj_matricies),  # ~ (n_views, 3, 4)
+        np.asarray(keypoints_3d),  # ~ (n_points, 3)
+        np.asarray(keypoints_2d_list).reshape(len(proj_matricies), -1, 2)  # ~ (n_views, n_points, 2)
+    )
+
+    return reprojection_errors.T  # ~ (n_points, n_views)
+
+
+def _solve_batch(A, b):
+    if hasattr(torch, 'linalg') and hasattr(torch.linalg, 'solve'):
+        return torch.linalg.solve(A, b)
+
+    solution, _ = torch.solve(b, A)  # old PyTorch
+    return solution
+
+
+def refine_batch_of_points_gauss_newton(proj_matricies_batch, points_batch, point_3d_batch, views_mask=None, n_iters=10, huber_threshold=1.0, damping=1e-6):
+    """Minimizes reprojection errors of all (batch, joint) pairs at once with (Huber-weighted) Gauss-Newton, i.e batched version of `scipy.optimize.least_squares(..., loss='huber')`
+
+    Args:
+        proj_matricies_batch torch tensor of shape (batch_size, n_views, 3, 4): projection matricies
+        points_batch torch tensor of shape (batch_size, n_views, n_joints, 2): points' coordinates
+        point_3d_batch torch tensor of shape (batch_size, n_joints, 3): initial guess
+        views_mask None or bool torch tensor of shape (batch_size, n_views, n_joints): False => view is ignored
+        huber_threshold float: reprojection error (in px) above which residuals are down-weighted
+
+    Returns:
+        point_3d_batch torch tensor of shape (batch_size, n_joints, 3): refined points
+    """
+
+    batch_size, n_views, n_joints = points_batch.shape[:3]
+    proj_matricies_batch = proj_matricies_batch.type(point_3d_batch.dtype)
+    points_batch = points_batch.type(point_3d_batch.dtype)
+
+    weights = torch.ones(batch_size, n_views, n_joints, dtype=point_3d_batch.dtype, device=point_3d_batch.device)
+    if not (views_mask is None):
+        weights = weights * views_mask.type(weights.dtype)
+
+    I = torch.eye(3, dtype=point_3d_batch.dtype, device=point_3d_batch.device)
+
+    for _ in range(n_iters):
+        homo = euclidean_to_homogeneous(point_3d_batch.reshape(-1, 3)).view(batch_size, n_joints, 4)
+        projected = torch.einsum('bvij,bkj->bvki', proj_matricies_batch, homo)  # ~ (batch_size, n_views, n_joints, 3)
+        depth = projected[..., 2:3]
+        uv = projected[..., :2] / depth
+
+        residuals = uv - points_batch  # ~ (batch_size, n_views, n_joints, 2)
+        jacobians = (
+            proj_matricies_batch[:, :, None, :2, :3] -
+            uv.unsqueeze(-1) * proj_matricies_batch[:, :, None, 2:3, :3]
+        ) / depth.unsqueeze(-1)  # ~ (batch_size, n_views, n_joints, 2, 3)
+
+        errors = 1 / 2 * torch.norm(residuals, dim=-1)  # same as `calc_reprojection_error_batch`
+        huber = torch.where(
+            errors > huber_threshold,
+            huber_threshold / errors.clamp(min=huber_threshold),
+            torch.ones_like(errors)
+        )
+        w = weights * huber
+
+        H = torch.einsum('bvjki,bvjkl,bvj->bjil', jacobians, jacobians, w)  # ~ (batch_size, n_joints, 3, 3)
+        g = torch.einsum('bvjki,bvjk,bvj->bji', jacobians, residuals, w)  # ~ (batch_size, n_joints, 3)
+
+        H = H + damping * torch.diagonal(H, dim1=-2, dim2=-1).sum(-1)[..., None, None] * I  # Levenberg-like, avoids singular systems
+        step = _solve_batch(H, -g.unsqueeze(-1)).squeeze(-1)
+        point_3d_batch = point_3d_batch + step
+
+    return point_3d_batch
+
+
+def triangulate_batch_of_points_ransac(proj_matricies_batch, points_batch, reprojection_error_epsilon=15, direct_optimization=True):
+    """ = RANSACTriangulationNet.triangulate_ransac but for all (batch, joint) pairs at once: instead of sampling, each view pair (C(n_views, 2) of them) is a hypothesis
+
+    Args:
+        proj_matricies_batch torch tensor of shape (batch_size, n_views, 3, 4): projection matricies
+        points_batch torch tensor of shape (batch_size, n_views, n_joints, 2): points' coordinates
+        reprojection_error_epsilon float: views with (hypothesis) reprojection error below it are inliers
+        direct_optimization bool: if True, refine with `refine_batch_of_points_gauss_newton`
+
+    Returns:
+        point_3d_batch torch tensor of shape (batch_size, n_joints, 3): triangulated points
+        inliers_mask bool torch tensor of shape (batch_size, n_views, n_joints): views used foreach joint
+    """
+
+    batch_size, n_views, n_joints = points_batch.shape[:3]
+    assert n_views >= 2
+
+    points_batch = points_batch.type(proj_matricies_batch.dtype)
+    device = points_batch.device
+
+    pairs = list(combinations(range(n_views), 2))  # C(4, 2) = 6 for Human3.6M
+    n_hypotheses = len(pairs)
+    pairs_mask = torch.zeros(n_hypotheses, n_views, dtype=torch.bool, device=device)
+    for hypothesis_i, pair in enumerate(pairs):
+        pairs_mask[hypothesis_i, list(pair)] = True
+
+    # triangulate all hypotheses ...
+    _expand = lambda x: x.unsqueeze(1).expand(batch_size, n_hypotheses, *x.shape[1:]).reshape(-1, *x.shape[1:])
+    hypotheses = triangulate_batch_of_points_linear(
+        _expand(proj_matricies_batch),
+        _expand(points_batch),
+        views_mask=pairs_mask.repeat(batch_size, 1)
+    ).view(batch_size, n_hypotheses, n_joints, 3)
+
+    # ... score them in all views ...
+    _, inliers = calc_reprojection_error_batch(
+        proj_matricies_batch.unsqueeze(1),  # broadcasted over hypotheses
+        hypotheses,
+        points_batch.unsqueeze(1),
+        reprojection_error_epsilon
+    )  # ~ (batch_size, n_hypotheses, n_views, n_joints)
+
+    inliers = inliers | pairs_mask.view(1, n_hypotheses, n_views, 1)
+
+    # ... and keep the one with most inliers (first one when tied)
+    best = torch.argmax(inliers.sum(dim=2), dim=1)  # ~ (batch_size, n_joints)
+    inliers_mask = torch.gather(
+        inliers, 1, best.view(batch_size, 1, 1, n_joints).expand(batch_size, 1, n_views, n_joints)
+    ).squeeze(1)  # ~ (batch_size, n_views, n_joints)
+
+    point_3d_batch = triangulate_batch_of_points_linear(
+        proj_matricies_batch, points_batch, views_mask=inliers_mask
+    )
+
+    if direct_optimization:
+        point_3d_batch = refine_batch_of_points_gauss_newton(
+            proj_matricies_batch, points_batch, point_3d_batch, views_mask=inliers_mask
+        )
 
-    return np.vstack(reprojection_error_matrix).T
+    return point_3d_batch, inliers_mask
 
 
 def _2camspace(ext_from, ext_to):
@@ -474,52 +1141,43 @@ def _my_proj(ext, K):
 
 
 def project2weak_views(K, cam_preds, kps_world_pred, where='world'):
-    """ assuming https://en.wikipedia.org/wiki/3D_projection#Weak_perspective_projection """
+    """ assuming https://en.wikipedia.org/wiki/3D_projection#Weak_perspective_projection
 
-    batch_size = cam_preds.shape[0]
-    n_views = cam_preds.shape[1]
-    dev = cam_preds.device
-    return torch.cat([
-        torch.cat([
-            _my_proj(
-                torch.eye(4).to(dev) if (where == 'master' and view_i == 0) else cam_preds[batch_i, view_i],
-                K.to(dev)
-            )(kps_world_pred[batch_i]).unsqueeze(0)
-            for view_i in range(n_views)
-        ]).unsqueeze(0).to(dev)  # pred
-        for batch_i in range(batch_size)
-    ])  # project DLT-ed points in all views
+    Args:
+        K torch tensor of shape (3, 4): (padded) intrinsics, same for all views
+        cam_preds torch tensor of shape (batch_size, n_views, 4, 4): extrinsics (when `where == 'master'`, 1st view is the master => identity)
+        kps_world_pred torch tensor of shape (batch_size, n_joints, 3): 3D points
+
+    Returns:
+        torch tensor of shape (batch_size, n_views, n_joints, 2): DLT-ed points projected in all views
+    """
+
+    full_cams = prepare_weak_cams_for_dlt(cam_preds, K, where)  # ~ (batch_size, n_views, 3, 4)
+    return project_batch_of_points(
+        full_cams,
+        kps_world_pred.to(cam_preds.device)
+    )
 
 
 def prepare_weak_cams_for_dlt(cams, K, where="world"):
-    batch_size = cams.shape[0]
-    n_views = cams.shape[1]
-    full_cams = torch.empty((batch_size, n_views, 3, 4))
-
-    for batch_i in range(batch_size):
-        if where == 'world':
-            full_cams[batch_i] = torch.cat([
-                torch.mm(
-                    K,
-                    cams[batch_i, view_i]
-                ).unsqueeze(0)
-                for view_i in range(n_views)
-            ])
-        elif where == 'master':
-            full_cams[batch_i] = torch.cat([
-                K.unsqueeze(0),  # doing DLT in master (0)'s camspace
-                torch.mm(
-                    K,
-                    cams[batch_i, 1]
-                ).unsqueeze(0),
-                torch.mm(
-                    K,
-                    cams[batch_i, 2]
-                ).unsqueeze(0),
-                torch.mm(
-                    K,
-                    cams[batch_i, 3]
-                ).unsqueeze(0),
-            ])  # ~ 4, 3, 4
-
-    return full_cams  # ~ batch_size, 4, 3, 4
\ No newline at end of file
+    """ K [R | t] foreach view, broadcasted over batch and (any number of) views. Keeps device and dtype of `cams`
+
+    Args:
+        cams torch tensor of shape (batch_size, n_views, 4, 4): extrinsics
+        K torch tensor of shape (3, 4): (padded) intrinsics, same for all views
+        where str: 'world' or 'master' (DLT in master (0)'s camspace => 1st projection is just K)
+
+    Returns:
+        torch tensor of shape (batch_size, n_views, 3, 4): projection matricies
+    """
+
+    K = K.to(device=cams.device, dtype=cams.dtype)
+
+    if where == 'world':
+        return K @ cams  # ~ batch_size, n_views, 3, 4
+    elif where == 'master':
+        batch_size = cams.shape[0]
+        return torch.cat([
+            K.expand(batch_size, 1, *K.shape),  # doing DLT in master (0)'s camspace
+            K @ cams[:, 1:]
+        ], dim=1)  # ~ batch_size, n_views, 3, 4
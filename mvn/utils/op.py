@@ -1,3 +1,5 @@
+from functools import lru_cache
+
 import numpy as np
 
 import torch
@@ -8,162 +10,273 @@ from mvn.utils.img import to_numpy, to_torch
 from mvn.utils import multiview
 
 
-def integrate_tensor_2d(heatmaps, softmax=True):
-    """Applies softmax to heatmaps and integrates them to get their's "center of masses"
+@lru_cache(maxsize=16)
+def _get_coord_vector(size, device, dtype):
+    """ 0, 1 ... size - 1 built once foreach (size, device, dtype). NOTE: shared => do not modify in-place """
+
+    return torch.arange(size, device=device).type(dtype)
+
+
+def soft_argmax_2d(heatmaps, xs, ys, softmax=True):
+    # type: (Tensor, Tensor, Tensor, bool) -> Tensor
+    """ fused soft-argmax: marginals are computed directly (log-sum-exp), so the normalized heatmaps are never kept. Pure tensor code => can be `torch.jit.script`ed
 
     Args:
         heatmaps torch tensor of shape (batch_size, n_heatmaps, h, w): input heatmaps
+        xs torch tensor of shape (w,): x coordinates
+        ys torch tensor of shape (h,): y coordinates
 
     Returns:
         coordinates torch tensor of shape (batch_size, n_heatmaps, 2): coordinates of center of masses of all heatmaps
-
     """
-    batch_size, n_heatmaps, h, w = heatmaps.shape
 
-    heatmaps = heatmaps.reshape((batch_size, n_heatmaps, -1))
     if softmax:
-        heatmaps = nn.functional.softmax(heatmaps, dim=2)
+        log_mass_x = torch.logsumexp(heatmaps, dim=2)  # ~ (batch_size, n_heatmaps, w)
+        log_mass_y = torch.logsumexp(heatmaps, dim=3)  # ~ (batch_size, n_heatmaps, h)
+        log_total = torch.logsumexp(log_mass_x, dim=2, keepdim=True)
+        mass_x = torch.exp(log_mass_x - log_total)
+        mass_y = torch.exp(log_mass_y - log_total)
     else:
-        heatmaps = nn.functional.relu(heatmaps)
+        heatmaps = F.relu(heatmaps)
+        mass_x = heatmaps.sum(dim=2)
+        mass_y = heatmaps.sum(dim=3)
+        total = mass_x.sum(dim=2, keepdim=True)
+        mass_x = mass_x / total
+        mass_y = mass_y / total
+
+    x = (mass_x * xs).sum(dim=2)
+    y = (mass_y * ys).sum(dim=2)
+    return torch.stack([x, y], dim=2)
 
-    heatmaps = heatmaps.reshape((batch_size, n_heatmaps, h, w))
 
-    mass_x = heatmaps.sum(dim=2)
-    mass_y = heatmaps.sum(dim=3)
+def soft_argmax_3d(volumes, xs, ys, zs, softmax=True):
+    # type: (Tensor, Tensor, Tensor, Tensor, bool) -> Tensor
+    """ = soft_argmax_2d but for volumes of shape (batch_size, n_volumes, x_size, y_size, z_size) """
 
-    mass_times_coord_x = mass_x * torch.arange(w).type(torch.float).to(mass_x.device)
-    mass_times_coord_y = mass_y * torch.arange(h).type(torch.float).to(mass_y.device)
+    if softmax:
+        log_mass_x = torch.logsumexp(volumes, dim=[3, 4])
+        log_mass_y = torch.logsumexp(volumes, dim=[2, 4])
+        log_mass_z = torch.logsumexp(volumes, dim=[2, 3])
+        log_total = torch.logsumexp(log_mass_x, dim=2, keepdim=True)
+        mass_x = torch.exp(log_mass_x - log_total)
+        mass_y = torch.exp(log_mass_y - log_total)
+        mass_z = torch.exp(log_mass_z - log_total)
+    else:
+        volumes = F.relu(volumes)
+        mass_x = volumes.sum(dim=[3, 4])
+        mass_y = volumes.sum(dim=[2, 4])
+        mass_z = volumes.sum(dim=[2, 3])
+        total = mass_x.sum(dim=2, keepdim=True)
+        mass_x = mass_x / total
+        mass_y = mass_y / total
+        mass_z = mass_z / total
 
-    x = mass_times_coord_x.sum(dim=2, keepdim=True)
-    y = mass_times_coord_y.sum(dim=2, keepdim=True)
+    x = (mass_x * xs).sum(dim=2)
+    y = (mass_y * ys).sum(dim=2)
+    z = (mass_z * zs).sum(dim=2)
+    return torch.stack([x, y, z], dim=2)
 
-    if not softmax:
-        x = x / mass_x.sum(dim=2, keepdim=True)
-        y = y / mass_y.sum(dim=2, keepdim=True)
 
-    coordinates = torch.cat((x, y), dim=2)
-    coordinates = coordinates.reshape((batch_size, n_heatmaps, 2))
+def _normalize_tensor(x, softmax, n_dims):
+    """ softmax (or relu) over the last `n_dims` dimensions """
 
-    return coordinates, heatmaps
+    if softmax:
+        shape = x.shape
+        return nn.functional.softmax(x.reshape(*shape[:-n_dims], -1), dim=-1).reshape(shape)
 
+    return nn.functional.relu(x)
 
-def integrate_tensor_3d(volumes, softmax=True):
-    batch_size, n_volumes, x_size, y_size, z_size = volumes.shape
 
-    volumes = volumes.reshape((batch_size, n_volumes, -1))
-    if softmax:
-        volumes = nn.functional.softmax(volumes, dim=2)
-    else:
-        volumes = nn.functional.relu(volumes)
+def integrate_tensor_2d(heatmaps, softmax=True, return_heatmaps=True):
+    """Applies softmax to heatmaps and integrates them to get their's "center of masses"
+
+    Args:
+        heatmaps torch tensor of shape (batch_size, n_heatmaps, h, w): input heatmaps
+        return_heatmaps: if False, the normalized heatmaps are not built (and None is returned instead)
 
-    volumes = volumes.reshape((batch_size, n_volumes, x_size, y_size, z_size))
+    Returns:
+        coordinates torch tensor of shape (batch_size, n_heatmaps, 2): coordinates of center of masses of all heatmaps
+        heatmaps torch tensor of shape (batch_size, n_heatmaps, h, w): normalized heatmaps (or None)
 
-    mass_x = volumes.sum(dim=3).sum(dim=3)
-    mass_y = volumes.sum(dim=2).sum(dim=3)
-    mass_z = volumes.sum(dim=2).sum(dim=2)
+    """
+    h, w = heatmaps.shape[-2:]
+    device, dtype = heatmaps.device, heatmaps.dtype
+    xs, ys = _get_coord_vector(w, device, dtype), _get_coord_vector(h, device, dtype)
 
-    mass_times_coord_x = mass_x * torch.arange(x_size).type(torch.float).to(mass_x.device)
-    mass_times_coord_y = mass_y * torch.arange(y_size).type(torch.float).to(mass_y.device)
-    mass_times_coord_z = mass_z * torch.arange(z_size).type(torch.float).to(mass_z.device)
+    if return_heatmaps:  # normalize once, integrate the result
+        heatmaps = _normalize_tensor(heatmaps, softmax, 2)
+        coordinates = torch.stack([
+            heatmaps.sum(dim=2) @ xs,
+            heatmaps.sum(dim=3) @ ys
+        ], dim=2)
+        if not softmax:  # relu => not normalized yet
+            coordinates = coordinates / heatmaps.sum(dim=[2, 3]).unsqueeze(-1)
 
-    x = mass_times_coord_x.sum(dim=2, keepdim=True)
-    y = mass_times_coord_y.sum(dim=2, keepdim=True)
-    z = mass_times_coord_z.sum(dim=2, keepdim=True)
+        return coordinates, heatmaps
 
-    if not softmax:
-        x = x / mass_x.sum(dim=2, keepdim=True)
-        y = y / mass_y.sum(dim=2, keepdim=True)
-        z = z / mass_z.sum(dim=2, keepdim=True)
+    return soft_argmax_2d(heatmaps, xs, ys, softmax), None
 
-    coordinates = torch.cat((x, y, z), dim=2)
-    coordinates = coordinates.reshape((batch_size, n_volumes, 3))
 
-    return coordinates, volumes
+def integrate_tensor_3d(volumes, softmax=True, return_volumes=True):
+    x_size, y_size, z_size = volumes.shape[-3:]
+    device, dtype = volumes.device, volumes.dtype
+    xs = _get_coord_vector(x_size, device, dtype)
+    ys = _get_coord_vector(y_size, device, dtype)
+    zs = _get_coord_vector(z_size, device, dtype)
 
+    if return_volumes:  # normalize once, integrate the result
+        volumes = _normalize_tensor(volumes, softmax, 3)
+        coordinates = torch.stack([
+            volumes.sum(dim=[3, 4]) @ xs,
+            volumes.sum(dim=[2, 4]) @ ys,
+            volumes.sum(dim=[2, 3]) @ zs
+        ], dim=2)
+        if not softmax:  # relu => not normalized yet
+            coordinates = coordinates / volumes.sum(dim=[2, 3, 4]).unsqueeze(-1)
 
-def integrate_tensor_3d_with_coordinates(volumes, coord_volumes, softmax=True):
-    batch_size, n_volumes, x_size, y_size, z_size = volumes.shape
+        return coordinates, volumes
 
-    volumes = volumes.reshape((batch_size, n_volumes, -1))
-    if softmax:
-        volumes = nn.functional.softmax(volumes, dim=2)
+    return soft_argmax_3d(volumes, xs, ys, zs, softmax), None
+
+
+def heatmap_to_image_coords(keypoints_2d, heatmap_shape, image_shape):
+    """ upscales keypoints from heatmap to image resolution with a single broadcasted multiply
+
+    Args:
+        keypoints_2d torch tensor of shape (..., 2): (x, y) in heatmap coordinates
+        heatmap_shape, image_shape: (height, width)
+
+    Returns:
+        torch tensor of shape (..., 2): (x, y) in image coordinates
+    """
+
+    scaling = keypoints_2d.new_tensor([
+        image_shape[1] / heatmap_shape[1], image_shape[0] / heatmap_shape[0]
+    ])
+    return keypoints_2d * scaling
+
+
+def heatmap_argmax_2d(heatmaps, subpixel=False):
+    """ hard argmax of heatmaps, optionally refined by a quarter pixel towards the highest neighbour (along x and y)
+
+    Args:
+        heatmaps torch tensor of shape (..., h, w): input heatmaps
+
+    Returns:
+        coordinates torch tensor of shape (..., 2): (x, y) of maxima, in heatmap coordinates
+    """
+
+    h, w = heatmaps.shape[-2:]
+    flat = heatmaps.reshape(*heatmaps.shape[:-2], -1)
+    max_indicies = flat.argmax(dim=-1, keepdim=True)
+
+    xs, ys = max_indicies % w, max_indicies // w
+    coordinates = torch.cat([xs, ys], dim=-1).type(heatmaps.dtype)
+
+    if subpixel:
+        def _neighbour(dx, dy):
+            nx = (xs + dx).clamp(0, w - 1)
+            ny = (ys + dy).clamp(0, h - 1)
+            return flat.gather(-1, ny * w + nx)
+
+        offsets = torch.cat([
+            _neighbour(1, 0) - _neighbour(-1, 0),
+            _neighbour(0, 1) - _neighbour(0, -1)
+        ], dim=-1)
+        coordinates = coordinates + 0.25 * torch.sign(offsets.detach())
+
+    return coordinates
+
+
+def _get_affine_axes(coord_volumes):
+    """ origin and steps of (affine) coord volumes ~ (..., x, y, z, 3), i.e coord[x, y, z] = origin + x * step_x + y * step_y + z * step_z """
+
+    origin = coord_volumes[..., 0, 0, 0, :]
+    x_size, y_size, z_size = coord_volumes.shape[-4:-1]
+
+    step_x = coord_volumes[..., 1, 0, 0, :] - origin if x_size > 1 else torch.zeros_like(origin)
+    step_y = coord_volumes[..., 0, 1, 0, :] - origin if y_size > 1 else torch.zeros_like(origin)
+    step_z = coord_volumes[..., 0, 0, 1, :] - origin if z_size > 1 else torch.zeros_like(origin)
+
+    return origin, step_x, step_y, step_z
+
+
+def integrate_tensor_3d_with_coordinates(volumes, coord_volumes, softmax=True, return_volumes=True):
+    """ `coord_volumes` is either shared by all volumes of a sample ~ (batch_size, x, y, z, 3) or one per volume ~ (batch_size, n_volumes, x, y, z, 3)
+
+    Args:
+        return_volumes: if False, the normalized volumes are not built (and None is returned instead): coordinates come from the log-sum-exp marginals, which requires affine `coord_volumes` (like the ones `volumetric.build_coord_volumes` builds)
+    """
+
+    if not return_volumes:
+        indices, _ = integrate_tensor_3d(volumes, softmax, return_volumes=False)  # ~ (batch_size, n_volumes, 3), in voxels
+        origin, step_x, step_y, step_z = _get_affine_axes(coord_volumes)
+        if coord_volumes.dim() == 5:  # shared by all volumes
+            origin, step_x, step_y, step_z = (x.unsqueeze(1) for x in (origin, step_x, step_y, step_z))
+
+        coordinates = origin + indices[..., 0:1] * step_x + indices[..., 1:2] * step_y + indices[..., 2:3] * step_z
+        return coordinates, None
+
+    volumes = _normalize_tensor(volumes, softmax, 3)
+    if coord_volumes.dim() == 6:  # one coord volume per volume
+        coordinates = torch.einsum("bnxyz, bnxyzc -> bnc", volumes, coord_volumes)
     else:
-        volumes = nn.functional.relu(volumes)
+        coordinates = torch.einsum("bnxyz, bxyzc -> bnc", volumes, coord_volumes)
 
-    volumes = volumes.reshape((batch_size, n_volumes, x_size, y_size, z_size))
-    coordinates = torch.einsum("bnxyz, bxyzc -> bnc", volumes, coord_volumes)
+    if not softmax:  # relu => not normalized yet (as in the `return_volumes=False` branch)
+        coordinates = coordinates / volumes.sum(dim=[2, 3, 4]).unsqueeze(-1)
 
     return coordinates, volumes
 
 
 def unproject_heatmaps(heatmaps, proj_matricies, coord_volumes, volume_aggregation_method='sum', vol_confidences=None):
-    device = heatmaps.device
     batch_size, n_views, n_joints, heatmap_shape = heatmaps.shape[0], heatmaps.shape[1], heatmaps.shape[2], tuple(heatmaps.shape[3:])
     volume_shape = coord_volumes.shape[1:4]
 
-    volume_batch = torch.zeros(batch_size, n_joints, *volume_shape, device=device)
-
-    # TODO: speed up this this loop
-    for batch_i in range(batch_size):
-        coord_volume = coord_volumes[batch_i]
-        grid_coord = coord_volume.reshape((-1, 3))
-
-        volume_batch_to_aggregate = torch.zeros(n_views, n_joints, *volume_shape, device=device)
-
-        for view_i in range(n_views):
-            heatmap = heatmaps[batch_i, view_i]
-            heatmap = heatmap.unsqueeze(0)
-
-            grid_coord_proj = multiview.project_3d_points_to_image_plane_without_distortion(
-                proj_matricies[batch_i, view_i], grid_coord, convert_back_to_euclidean=False
-            )
-
-            invalid_mask = grid_coord_proj[:, 2] <= 0.0  # depth must be larger than 0.0
-
-            grid_coord_proj[grid_coord_proj[:, 2] == 0.0, 2] = 1.0  # not to divide by zero
-            grid_coord_proj = multiview.homogeneous_to_euclidean(grid_coord_proj)
-
-            # transform to [-1.0, 1.0] range
-            grid_coord_proj_transformed = torch.zeros_like(grid_coord_proj)
-            grid_coord_proj_transformed[:, 0] = 2 * (grid_coord_proj[:, 0] / heatmap_shape[0] - 0.5)
-            grid_coord_proj_transformed[:, 1] = 2 * (grid_coord_proj[:, 1] / heatmap_shape[1] - 0.5)
-            grid_coord_proj = grid_coord_proj_transformed
-
-            # prepare to F.grid_sample
-            grid_coord_proj = grid_coord_proj.unsqueeze(1).unsqueeze(0)
-            try:
-                current_volume = F.grid_sample(heatmap, grid_coord_proj, align_corners=True)
-            except TypeError: # old PyTorch
-                current_volume = F.grid_sample(heatmap, grid_coord_proj)
-
-            # zero out non-valid points
-            current_volume = current_volume.view(n_joints, -1)
-            current_volume[:, invalid_mask] = 0.0
-
-            # reshape back to volume
-            current_volume = current_volume.view(n_joints, *volume_shape)
-
-            # collect
-            volume_batch_to_aggregate[view_i] = current_volume
-
-        # agregate resulting volume
-        if volume_aggregation_method.startswith('conf'):
-            volume_batch[batch_i] = (volume_batch_to_aggregate * vol_confidences[batch_i].view(n_views, n_joints, 1, 1, 1)).sum(0)
-        elif volume_aggregation_method == 'sum':
-            volume_batch[batch_i] = volume_batch_to_aggregate.sum(0)
-        elif volume_aggregation_method == 'max':
-            volume_batch[batch_i] = volume_batch_to_aggregate.max(0)[0]
-        elif volume_aggregation_method == 'softmax':
-            volume_batch_to_aggregate_softmin = volume_batch_to_aggregate.clone()
-            volume_batch_to_aggregate_softmin = volume_batch_to_aggregate_softmin.view(n_views, -1)
-            volume_batch_to_aggregate_softmin = nn.functional.softmax(volume_batch_to_aggregate_softmin, dim=0)
-            volume_batch_to_aggregate_softmin = volume_batch_to_aggregate_softmin.view(n_views, n_joints, *volume_shape)
-
-            volume_batch[batch_i] = (volume_batch_to_aggregate * volume_batch_to_aggregate_softmin).sum(0)
-        else:
-            raise ValueError("Unknown volume_aggregation_method: {}".format(volume_aggregation_method))
-
-    return volume_batch
+    # project all coord volumes through all views at once
+    grid_coord = coord_volumes.reshape(batch_size, -1, 3)  # ~ (batch_size, n_points, 3)
+    grid_coord_proj = multiview.project_batch_of_points(
+        proj_matricies, grid_coord, convert_back_to_euclidean=False
+    )  # ~ (batch_size, n_views, n_points, 3)
+
+    depth = grid_coord_proj[..., 2:]
+    valid_mask = depth > 0.0  # depth must be larger than 0.0
+    depth = torch.where(depth == 0.0, torch.ones_like(depth), depth)  # not to divide by zero
+    grid_coord_proj = grid_coord_proj[..., :2] / depth
+
+    # transform to [-1.0, 1.0] range
+    scaling = grid_coord_proj.new_tensor([heatmap_shape[0], heatmap_shape[1]])
+    grid_coord_proj = 2 * (grid_coord_proj / scaling - 0.5)
+
+    # prepare to F.grid_sample: (batch_size * n_views) as batch
+    heatmaps = heatmaps.reshape(batch_size * n_views, n_joints, *heatmap_shape)
+    grid_coord_proj = grid_coord_proj.reshape(batch_size * n_views, -1, 1, 2).type(heatmaps.dtype)
+    try:
+        volumes = F.grid_sample(heatmaps, grid_coord_proj, align_corners=True)
+    except TypeError: # old PyTorch
+        volumes = F.grid_sample(heatmaps, grid_coord_proj)
+
+    # zero out non-valid points
+    volumes = volumes.view(batch_size, n_views, n_joints, -1)
+    volumes = volumes * valid_mask.view(batch_size, n_views, 1, -1).type(volumes.dtype)
+
+    # reshape back to volume
+    volumes = volumes.view(batch_size, n_views, n_joints, *volume_shape)
+
+    # agregate resulting volume over views
+    if volume_aggregation_method.startswith('conf'):
+        volume_batch = (volumes * vol_confidences.view(batch_size, n_views, n_joints, 1, 1, 1)).sum(1)
+    elif volume_aggregation_method == 'sum':
+        volume_batch = volumes.sum(1)
+    elif volume_aggregation_method == 'max':
+        volume_batch = volumes.max(1)[0]
+    elif volume_aggregation_method == 'softmax':
+        volumes_softmin = nn.functional.softmax(volumes, dim=1)
+        volume_batch = (volumes * volumes_softmin).sum(1)
+    else:
+        raise ValueError("Unknown volume_aggregation_method: {}".format(volume_aggregation_method))
+
+    return volume_batch  # ~ (batch_size, n_joints, *volume_shape)
 
 
 def gaussian_2d_pdf(coords, means, sigmas, normalize=True):
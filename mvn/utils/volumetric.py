@@ -1,3 +1,5 @@
+from functools import lru_cache
+
 import numpy as np
 import cv2
 import torch
@@ -112,3 +114,67 @@ def rotate_coord_volume(coord_volume, theta, axis):
     coord_volume = coord_volume.view(*shape)
 
     return coord_volume
+
+
+def get_rotation_matrices(axis, thetas):
+    """ = get_rotation_matrix but for many angles at once
+
+    Args:
+        axis: rotation axis (3,)
+        thetas numpy array of shape (N,): angles in radians
+
+    Returns:
+        numpy array of shape (N, 3, 3): rotation matricies
+    """
+
+    axis = np.asarray(axis, dtype=np.float64)
+    axis = axis / np.sqrt(np.dot(axis, axis))
+    thetas = np.asarray(thetas, dtype=np.float64)
+
+    a = np.cos(thetas / 2.0)
+    b, c, d = -axis[:, None] * np.sin(thetas / 2.0)
+    aa, bb, cc, dd = a * a, b * b, c * c, d * d
+    bc, ad, ac, ab, bd, cd = b * c, a * d, a * c, a * b, b * d, c * d
+    return np.stack([
+        np.stack([aa + bb - cc - dd, 2 * (bc + ad), 2 * (bd - ac)], axis=-1),
+        np.stack([2 * (bc - ad), aa + cc - bb - dd, 2 * (cd + ab)], axis=-1),
+        np.stack([2 * (bd + ac), 2 * (cd - ab), aa + dd - bb - cc], axis=-1)
+    ], axis=-2)
+
+
+@lru_cache(maxsize=8)
+def get_unit_coord_grid(volume_size, device, dtype=torch.float):
+    """ (volume_size ** 3, 3) grid of points in [0, 1] ** 3, built once foreach (volume_size, device, dtype). NOTE: shared => do not modify in-place """
+
+    xxx, yyy, zzz = torch.meshgrid(
+        torch.arange(volume_size, device=device),
+        torch.arange(volume_size, device=device),
+        torch.arange(volume_size, device=device)
+    )
+    grid = torch.stack([xxx, yyy, zzz], dim=-1).type(dtype)
+    return grid.reshape((-1, 3)) / (volume_size - 1)
+
+
+def build_coord_volumes(base_points, cuboid_side, volume_size, thetas, axis):
+    """ coord volumes of cuboids (L x L x L) centered in `base_points` and rotated by `thetas` around `axis`, for all samples at once
+
+    Args:
+        base_points torch tensor of shape (batch_size, 3): centers of cuboids
+        thetas numpy array of shape (batch_size,): rotation angles
+
+    Returns:
+        torch tensor of shape (batch_size, volume_size, volume_size, volume_size, 3): coord volumes
+    """
+
+    batch_size = base_points.shape[0]
+    device, dtype = base_points.device, base_points.dtype
+
+    unit_grid = get_unit_coord_grid(volume_size, device, dtype)
+    local_grid = cuboid_side * unit_grid - cuboid_side / 2  # wrt center, ~ (n_points, 3)
+
+    rotations = torch.from_numpy(
+        get_rotation_matrices(axis, thetas)
+    ).type(dtype).to(device)  # ~ (batch_size, 3, 3)
+
+    coord_volumes = local_grid @ rotations.transpose(1, 2) + base_points.unsqueeze(1)  # ~ (batch_size, n_points, 3)
+    return coord_volumes.view(batch_size, volume_size, volume_size, volume_size, 3)
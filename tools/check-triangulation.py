@@ -0,0 +1,60 @@
+"""
+    Check that the normal-equations triangulation (`triangulate_batch_of_points_normal_equations`, 'eigh' and 'jacobi')
+    matches the batched SVD one (`triangulate_batch_of_points_linear`) on noise-free, Human3.6M-like float32 data
+
+    Usage: `python3 check-triangulation.py [<batch-size>] [<tolerance-mm>]`
+"""
+import os, sys
+import numpy as np
+import torch
+
+try:    batch_size = int(sys.argv[1])
+except: batch_size = 64
+
+try:    tolerance = float(sys.argv[2])
+except: tolerance = 1.0  # mm
+
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), ".."))
+from mvn.utils.multiview import build_intrinsics, project_batch_of_points, triangulate_batch_of_points_linear, triangulate_batch_of_points_normal_equations
+from mvn.utils.img import rotation_matrices_from_vectors_rodrigues
+
+n_views, n_joints = 4, 17
+rng = np.random.RandomState(42)
+
+# cameras ~ 5 m away, looking at the origin
+angles = rng.uniform(0, 2 * np.pi, size=(batch_size, n_views))
+centers = np.stack([
+    5e3 * np.cos(angles), 5e3 * np.sin(angles), rng.uniform(1e3, 2e3, size=angles.shape)
+], axis=-1)  # ~ (batch_size, n_views, 3)
+Rs = rotation_matrices_from_vectors_rodrigues(
+    -centers.reshape(-1, 3),
+    np.array([0.0, 0.0, 1.0])
+).reshape(batch_size, n_views, 3, 3)  # towards origin -> camera z
+ts = -Rs @ centers[..., None]
+K = build_intrinsics(translation=(500, 500), f=(1145, 1145), shear=0)
+
+proj_matricies = torch.from_numpy(
+    K @ np.concatenate([Rs, ts], axis=-1)
+).float()  # ~ (batch_size, n_views, 3, 4)
+keypoints_3d = torch.from_numpy(
+    rng.uniform(-1e3, 1e3, size=(batch_size, n_joints, 3))
+).float()
+keypoints_2d = project_batch_of_points(proj_matricies, keypoints_3d)  # ~ (batch_size, n_views, n_joints, 2)
+
+preds = {
+    'svd': triangulate_batch_of_points_linear(proj_matricies, keypoints_2d)
+}
+for method in ('eigh', 'jacobi'):
+    preds[method] = triangulate_batch_of_points_normal_equations(proj_matricies, keypoints_2d, method=method)
+
+failed = False
+for method, keypoints_3d_pred in preds.items():
+    error = torch.norm(keypoints_3d_pred - keypoints_3d, dim=-1)
+    print('{:>6}: mean {:.4f} mm, max {:.4f} mm'.format(method, error.mean().item(), error.max().item()))
+
+    distance = torch.norm(keypoints_3d_pred - preds['svd'], dim=-1).max().item()
+    if distance > tolerance:
+        print('{} differs from svd by up to {:.4f} mm (> {} mm)'.format(method, distance, tolerance))
+        failed = True
+
+sys.exit(1 if failed else 0)